@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:17 2026
+
+@author: pasquale
+"""
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:17 2026
+
+@author: pasquale
+"""
+
+import sys
+
+from .runner import main
+
+if (__name__ == "__main__"):
+    sys.exit(main())
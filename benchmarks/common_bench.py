@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+util.common microbenchmarks: Wrap access, evaluate_string and include loading.
+
+Created on Mon Oct 19 16:31:44 2026
+
+@author: pasquale
+"""
+
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from util.common import Wrap, evaluate_string
+
+
+def measure(func, min_time, alloc_ops):
+    func()
+
+    number = 1
+
+    while True:
+        start = time.perf_counter()
+
+        for _ in range(number):
+            func()
+
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= min_time:
+            break
+
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    # allocations are measured on a separate, shorter run: tracemalloc
+    # slows every allocation down and would distort the timing above
+    gc.collect()
+    tracemalloc.start()
+
+    before = tracemalloc.take_snapshot()
+    base, _ = tracemalloc.get_traced_memory()
+    peak_total = 0
+    peak_max = 0
+
+    for _ in range(alloc_ops):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        func()
+
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - current
+        peak_max = max(peak_max, peak - current)
+
+    end, _ = tracemalloc.get_traced_memory()
+    blocks = sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+
+    tracemalloc.stop()
+
+    # tracemalloc cannot count the blocks an operation allocates and frees
+    # again, so allocations are approximated from two sides: the peak memory
+    # above the starting point while one operation runs (mean and max over
+    # the traced run), and the net bytes and blocks (snapshot diff) still
+    # allocated once the traced run is over, spread over its operations
+    return {
+        "ops" : number,
+        "ops_per_s" : number / elapsed,
+        "us_per_op" : elapsed / number * 1e6,
+        "approx_alloc_peak_bytes_per_op" : peak_total / alloc_ops,
+        "approx_alloc_max_peak_bytes_per_op" : peak_max,
+        "approx_alloc_net_bytes_per_op" : (end - base) / alloc_ops,
+        "approx_alloc_net_blocks_per_op" : blocks / alloc_ops
+    }
+
+
+def deep_tree(depth):
+    node = { "leaf" : 1 }
+
+    for i in range(depth):
+        node = { "child" : node, "value" : i }
+
+    return node
+
+
+def walk_to_dict(wrap):
+    result = wrap.to_dict()
+
+    for k, v in result.items():
+        if isinstance(v, Wrap):
+            result[k] = walk_to_dict(v)
+
+    return result
+
+
+def cases(tmpdir):
+    include_path = os.path.join(tmpdir, "include.json")
+
+    with open(include_path, "wt") as f:
+        json.dump({ "root" : { "items" : list(range(100)), "name" : "include" } }, f)
+
+    include_url = "file:" + include_path
+    context = { "name" : "bench", "n" : "42" }
+
+    access = Wrap({
+        "plain" : "value",
+        "[simple]" : "Hello ${name}",
+        "[[evaluated]]" : "int(${n}) * 2",
+        "@include" : { "url" : include_url, "root" : "root" }
+    }, context)
+
+    wide = Wrap({ f"key_{i}" : i for i in range(1000) }, context)
+    wide_simple = Wrap({ f"[key_{i}]" : f"${{name}}_{i}" for i in range(1000) }, context)
+    deep = Wrap(deep_tree(50), context)
+    items = Wrap(list(range(1000)), context)
+    nested_items = Wrap([ { "i" : i } for i in range(1000) ], context)
+
+    result = {
+        "getattr_plain" : lambda: access.plain,
+        "getattr_simple" : lambda: access.simple,
+        "getattr_eval" : lambda: access.evaluated,
+        "getattr_include" : lambda: access.include,
+        "getattr_missing" : lambda: access.missing,
+        "to_dict_wide_1000" : wide.to_dict,
+        "to_dict_wide_simple_1000" : wide_simple.to_dict,
+        "to_dict_deep_50" : lambda: walk_to_dict(deep),
+        "to_list_1000" : items.to_list,
+        "to_list_dicts_1000" : nested_items.to_list,
+        "iter_1000" : lambda: sum(1 for _ in items),
+        "iter_dicts_1000" : lambda: sum(1 for _ in nested_items),
+        "load_file" : lambda: Wrap.load(include_url),
+        "load_file_root" : lambda: Wrap.load(include_url, "root"),
+        "load_file_cold" : lambda: _cold_load(include_url)
+    }
+
+    for placeholders in (0, 1, 10, 100):
+        pattern = " ".join([ "text" ] + [ "${name}" ] * placeholders)
+        ctx = { "name" : "value" }
+
+        result[f"evaluate_string_{placeholders}"] = _bind_evaluate(pattern, ctx)
+
+    return result
+
+
+def _bind_evaluate(pattern, context):
+    return lambda: evaluate_string(pattern, context, False)
+
+
+def _cold_load(url):
+    Wrap.include_cache().clear()
+
+    return Wrap.load(url)
+
+
+def add_arguments(parser):
+    parser.add_argument("--min-time", help="minimum seconds per case", type=float, default=0.2, dest="min_time")
+    parser.add_argument("--alloc-ops", help="operations traced per case for allocations", type=int, default=200, dest="alloc_ops")
+    parser.add_argument("--case", help="run only cases containing this substring", type=str, default=None, dest="case")
+
+
+def run(opts):
+    result = dict()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, func in cases(tmpdir).items():
+            if opts.case and opts.case not in name:
+                continue
+
+            result[name] = measure(func, opts.min_time, opts.alloc_ops)
+
+    return result
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:17 2026
+
+@author: pasquale
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+
+from argparse import ArgumentParser
+
+from . import common_bench, task_bench
+
+SUITES = {
+    "common" : common_bench,
+    "task" : task_bench
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            [ "git", "rev-parse", "HEAD" ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def metadata():
+    return {
+        "revision" : git_revision(),
+        "timestamp" : time.time(),
+        "python" : platform.python_version(),
+        "implementation" : platform.python_implementation(),
+        "platform" : platform.platform(),
+        "cpu_count" : os.cpu_count()
+    }
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="benchmarks", description="py_util benchmark suites")
+    parser.add_argument("-o", "--output", help="JSON result file (default: stdout)", type=str, default=None, dest="output")
+
+    subparsers = parser.add_subparsers(dest="suite")
+    subparsers.required = True
+
+    for name, suite in SUITES.items():
+        suite.add_arguments(subparsers.add_parser(name, help=suite.__doc__.strip().splitlines()[0]))
+
+    opts = parser.parse_args(argv)
+
+    result = {
+        "suite" : opts.suite,
+        "metadata" : metadata(),
+        "parameters" : { k: v for k, v in vars(opts).items() if k not in ("suite", "output") },
+        "results" : SUITES[opts.suite].run(opts)
+    }
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+
+    if opts.output:
+        with open(opts.output, "wt") as f:
+            f.write(text)
+            f.write("\n")
+    else:
+        print(text)
+
+    return 0
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:02:17 2026
+
+@author: pasquale
+"""
+
+
+def percentile(values, p):
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(p / 100.0 * (len(ordered) - 1)))))
+
+    return ordered[idx]
+
+
+def median(values):
+    return percentile(values, 50)
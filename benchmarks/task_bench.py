@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+TaskManager dispatch, scheduler accuracy and admission overhead.
+
+Created on Mon Oct 19 10:02:17 2026
+
+@author: pasquale
+"""
+
+import datetime
+import gc
+import logging
+import threading
+import time
+import tracemalloc
+
+from util.common import Wrap
+from util.task import Task, TaskManager, TaskScheduler, TASK_TYPE_SUBPROCESS
+
+from .stats import median, percentile
+
+DEFAULT_SIZES = "10,100,1000,10000"
+
+
+class BenchTask(Task):
+    """
+    Task recording the instant it starts running; in-process tasks skip
+    the subprocess entirely so that pure dispatch overhead is measured.
+    """
+
+    def __init__(self, name, type, logger, options, in_process, starts, gate=None):
+        super(BenchTask, self).__init__(name, type, logger, options)
+        self._in_process = in_process
+        self._starts = starts
+        self._gate = gate
+
+    def __call__(self, *args, **kwargs):
+        submitted = kwargs.pop("_submitted", None)
+
+        if submitted is not None:
+            self._starts.append(time.perf_counter() - submitted)
+
+        if self._gate is not None:
+            self._gate.wait()
+
+        if self._in_process:
+            return 0
+        else:
+            return super(BenchTask, self).__call__(*args, **kwargs)
+
+
+def make_tasklist(size, conflict_every=5, singleton_every=7):
+    tasklist = list()
+
+    for i in range(size):
+        task = {
+            "name" : f"task_{i:05d}",
+            "type" : TASK_TYPE_SUBPROCESS,
+            "description" : "Synthetic no-op task",
+            "singleton" : (singleton_every > 0 and i % singleton_every == 0),
+            "command" : [ "true" ]
+        }
+
+        if conflict_every > 0 and i % conflict_every == 0 and size > 1:
+            task["conflict"] = [ f"task_{(i + 1) % size:05d}" ]
+
+        tasklist.append(task)
+
+    return tasklist
+
+
+def make_manager(tasklist, logger):
+    manager = TaskManager.__new__(TaskManager)
+    manager._config = Wrap(dict())
+    manager._context = dict()
+    manager._logger = logger
+    manager._task_list = dict()
+
+    manager._init_monitor()
+    manager._init_task_list(Wrap(tasklist))
+
+    return manager
+
+
+def bench_startup(sizes, repeat, logger):
+    result = dict()
+
+    for size in sizes:
+        tasklist = make_tasklist(size)
+        timings = list()
+
+        for _ in range(repeat):
+            manager = TaskManager.__new__(TaskManager)
+            manager._logger = logger
+            manager._task_list = dict()
+
+            start = time.perf_counter()
+            manager._init_task_list(Wrap(tasklist))
+            timings.append(time.perf_counter() - start)
+
+        result[str(size)] = {
+            "median_s" : median(timings),
+            "per_task_us" : median(timings) / size * 1e6
+        }
+
+    return result
+
+
+def bench_dispatch(sizes, runs, in_process, logger):
+    result = dict()
+
+    for size in sizes:
+        manager = make_manager(make_tasklist(size), logger)
+        starts = list()
+
+        for name, task in list(manager.task_list.items()):
+            manager.task_list[name] = BenchTask(
+                task.name, task.type, logger,
+                { "singleton" : task.singleton, "conflict" : task.conflict, "command" : task.command },
+                in_process, starts)
+
+        tasks = list(manager.task_list.values())
+        futures = list()
+        rejected = 0
+
+        start = time.perf_counter()
+
+        for i in range(runs):
+            outcome = manager.run_task(tasks[i % len(tasks)], None, { "_submitted" : time.perf_counter() })
+
+            if isinstance(outcome, int):
+                rejected += 1
+            else:
+                futures.append(outcome[1])
+
+        for future in futures:
+            future.result()
+
+        elapsed = time.perf_counter() - start
+
+        manager._pool.shutdown(wait=True)
+
+        result[str(size)] = {
+            "runs" : runs,
+            "admitted" : len(futures),
+            "rejected" : rejected,
+            "elapsed_s" : elapsed,
+            "runs_per_s" : len(futures) / elapsed if elapsed > 0 else None,
+            "latency_p50_ms" : _ms(percentile(starts, 50)),
+            "latency_p99_ms" : _ms(percentile(starts, 99))
+        }
+
+    return result
+
+
+def bench_queued_memory(runs, logger):
+    gate = threading.Event()
+    starts = list()
+
+    manager = make_manager(list(), logger)
+    task = BenchTask(
+        "queued", TASK_TYPE_SUBPROCESS, logger, { "singleton" : False }, True, starts, gate)
+
+    gc.collect()
+    tracemalloc.start()
+
+    before = tracemalloc.take_snapshot()
+    futures = [ manager.run_task(task, None, dict())[1] for _ in range(runs) ]
+    after = tracemalloc.take_snapshot()
+
+    tracemalloc.stop()
+
+    gate.set()
+
+    for future in futures:
+        future.result()
+
+    manager._pool.shutdown(wait=True)
+
+    delta = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+    return {
+        "runs" : runs,
+        "bytes_total" : delta,
+        "bytes_per_run" : delta / runs if runs > 0 else None
+    }
+
+
+def bench_scheduler(jobs, duration, logger):
+    import schedule
+
+    errors = list()
+
+    def record(job):
+        errors.append((datetime.datetime.now() - job.next_run).total_seconds())
+
+    class Holder(object):
+        has_scheduler = False
+
+    schedule.clear()
+
+    for _ in range(jobs):
+        job = schedule.every(1).seconds
+        job.do(record, job)
+
+    scheduler = TaskScheduler(Holder(), logger)
+    scheduler.start()
+    time.sleep(duration)
+    scheduler.stop()
+
+    schedule.clear()
+
+    return {
+        "jobs" : jobs,
+        "duration_s" : duration,
+        "fired" : len(errors),
+        "error_p50_ms" : _ms(percentile(errors, 50)),
+        "error_p99_ms" : _ms(percentile(errors, 99)),
+        "error_max_ms" : _ms(max(errors) if errors else None)
+    }
+
+
+def _ms(value):
+    return None if value is None else value * 1000.0
+
+
+def add_arguments(parser):
+    parser.add_argument("--sizes", help="comma separated tasklist sizes", type=str, default=DEFAULT_SIZES, dest="sizes")
+    parser.add_argument("--runs", help="runs submitted per dispatch measure", type=int, default=2000, dest="runs")
+    parser.add_argument("--subprocess-runs", help="runs submitted per subprocess dispatch measure", type=int, default=200, dest="subprocess_runs")
+    parser.add_argument("--repeat", help="repetitions of the startup measure", type=int, default=5, dest="repeat")
+    parser.add_argument("--queued-runs", help="runs kept queued for the memory measure", type=int, default=10000, dest="queued_runs")
+    parser.add_argument("--scheduler-jobs", help="jobs registered for the scheduler measure", type=int, default=20, dest="scheduler_jobs")
+    parser.add_argument("--scheduler-duration", help="seconds the scheduler measure lasts (0 = skip)", type=float, default=5.0, dest="scheduler_duration")
+
+
+def run(opts):
+    logger = logging.getLogger("benchmarks.task")
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+
+    sizes = [ int(s) for s in opts.sizes.split(",") if s.strip() ]
+
+    result = {
+        "startup" : bench_startup(sizes, opts.repeat, logger),
+        "dispatch_in_process" : bench_dispatch(sizes, opts.runs, True, logger),
+        "dispatch_subprocess" : bench_dispatch(sizes, opts.subprocess_runs, False, logger),
+        "queued_memory" : bench_queued_memory(opts.queued_runs, logger)
+    }
+
+    if opts.scheduler_duration > 0:
+        result["scheduler"] = bench_scheduler(opts.scheduler_jobs, opts.scheduler_duration, logger)
+
+    return result
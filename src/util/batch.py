@@ -6,33 +6,55 @@ Created on Sat Jan 13 16:22:52 2018
 @author: pasquale
 """
 
+import collections
+import concurrent.futures as cf
+import csv
 import importlib
+import itertools
 import json
 import logging
 import logging.config
+import multiprocessing
+import os
+import queue
 import re
 import sys
+import tempfile
+import threading
+import time
 import traceback
 
 from argparse import ArgumentParser, REMAINDER
 
 from .common import Wrap
+from .log import LogQueue
+from .profiling import format_import_profile, import_profile, run_profiled, PhaseTimer, PROFILE_CPU, PROFILE_MEM
 
 
 class Batch(object):
     
     SYS_runtime_id = "SYS.runtime_id"
     
-    def __init__(self, config, batch_name, batch, args):
+    def __init__(self, config, batch_name, batch, args, log_queue=None, timer=None, profile=None, metrics_file=None):
         self.name = config.name
+        self.batch_name = batch_name
         self.config = config
         self.logger = logging.getLogger(config.logger)
+        self.log_queue = log_queue
+        self.timer = timer or PhaseTimer()
+        self.profile = profile
+        self.metrics_file = metrics_file
+        self.rc = None
+        
+        self._load_stats = Wrap.load_stats()
         
         self._init_log()
         
-        self.context = Wrap.prepare_context(args)
+        self.context = args if isinstance(args, dict) else Wrap.prepare_context(args)
         self.config.bind_context(self.context)
-        self.batch = batch(config.batch_config[batch_name], self.context, self.logger)
+        
+        with self.timer.phase("construct"):
+            self.batch = batch(config.batch_config[batch_name], self.context, self.logger)
     
     
     def _init_log(self):
@@ -55,20 +77,75 @@ class Batch(object):
         try:
             self.logger.debug("Running batch...")
             
-            rc = self.batch.execute()
+            with self.timer.phase("execute"):
+                if (self.profile is not None):
+                    rc = self._execute_profiled()
+                else:
+                    rc = self.batch.execute()
             
             self.logger.debug("Batch executed properly. Exit code is '{0}'".format(rc))
             
-            return rc if rc else 0
+            self.rc = rc if rc else 0
         except Exception as ex:
             self.logger.error("Batch execution error: {0} \"{1}\"".format(type(ex), ex))
             traceback.print_exc()
             
-            return 1
+            self.rc = 1
+        
+        return self.rc
+    
+    
+    def _execute_profiled(self):
+        rc, report = run_profiled(self.batch.execute, self.profile["kind"], self.profile["top"])
+        
+        if (self.profile.get("output")):
+            with open(self.profile["output"], "wt") as f:
+                f.write(report)
+            
+            self.logger.info("Profile report written to '{0}'".format(self.profile["output"]))
+        else:
+            for line in report.splitlines():
+                self.logger.info(line)
+        
+        return rc
+    
+    
+    def _report_timing(self):
+        load_stats = Wrap.load_stats()
+        includes = load_stats["count"] - self._load_stats["count"]
+        
+        if (includes > 0):
+            self.timer.add("include", load_stats["seconds"] - self._load_stats["seconds"])
+        
+        self.timer.log(self.logger)
+        
+        if (self.metrics_file is not None):
+            try:
+                self.timer.write(self.metrics_file, name=self.name, batch=self.batch_name, rc=self.rc, includes=includes)
+            except Exception as ex:
+                self.logger.warning("Cannot write metrics file '{0}': {1}".format(self.metrics_file, ex))
     
     
     def __exit__(self, *args):
         self.logger.debug("Exiting Context Manager... (args={0})".format(args))
+        
+        self._report_timing()
+        
+        if (self.log_queue is not None):
+            self.log_queue.stop()
+    
+    
+    @staticmethod
+    def report_import_profile(module_name, budget=None):
+        lines, total = format_import_profile(import_profile([ "util.batch", module_name ]))
+        
+        for line in lines:
+            logging.info(line)
+            print(line, file=sys.stderr)
+        
+        if (budget is not None and total / 1000.0 > budget):
+            logging.warning(
+                "Import time {0:.1f} ms exceeds budget of {1:.1f} ms".format(total / 1000.0, budget))
     
     
     @staticmethod 
@@ -76,6 +153,71 @@ class Batch(object):
         return json.get("name") is not None
     
     
+    @staticmethod
+    def load_log_config(log_config_file):
+        try:
+            logging.debug(
+                "Loading new logger configuration from file '{0}'".format(log_config_file))
+            
+            # apply new configuration
+            logging.config.fileConfig(log_config_file)
+            logging.info(
+                "New logger configuration applied from file '{0}'".format(log_config_file))
+        except Exception as ex:
+            logging.error(
+                "Cannot apply new logger configuration from file '{0}'".format(log_config_file))
+            
+            raise RuntimeError(
+                "Configuration error: Cannot apply new logger configuration from file '{0}'".format(log_config_file), ex)
+    
+    
+    @classmethod
+    def load_config(cls, json_config_file):
+        try:
+            with open(json_config_file, "rt") as f:
+                config = json.load(f)
+                
+                if (not cls.validate(config)):
+                    logging.error(
+                        "Configuration not valid from file '{0}'".format(json_config_file))
+                    
+                    raise RuntimeError(
+                        "Configuration error: Configuration not valid from file '{0}'".format(json_config_file))
+                
+                return config
+        except Exception as ex:
+            logging.error(
+                "Cannot load configuration from file '{0}'".format(json_config_file))
+            
+            raise RuntimeError(
+                "Configuration error: Cannot load configuration from file '{0}'".format(json_config_file), ex)
+    
+    
+    @staticmethod
+    def load_class(batch_class):
+        try:
+            dot = batch_class.rfind(".")
+            
+            assert dot >= 0
+            
+            module_name = batch_class[0:dot]
+            class_name = batch_class[(dot+1):]
+            
+            logging.debug("Loading class '{0}.{1}'".format(module_name, class_name))
+        
+            logging.debug("Loading module '{0}'...".format(module_name))
+            module = importlib.import_module(module_name)
+            
+            logging.debug("Loading class '{0}'...".format(class_name))
+            return eval(f"module.{class_name}")
+        except Exception as ex:
+            logging.error(
+                "Cannot load batch class '{0}".format(batch_class))
+            
+            raise RuntimeError(
+                "Configuration error: Cannot load batch class '{0}'".format(batch_class), ex)
+    
+    
     @classmethod
     def create(cls):
         parser = ArgumentParser()
@@ -83,75 +225,442 @@ class Batch(object):
         parser.add_argument("-l", "--log-config", help="logger config file", type=str, default="logging.conf", dest="log_config_file")
         parser.add_argument("-c", "--config", help="JSON config file", type=str, default="config.json", dest="json_config_file")
         parser.add_argument("-b", "--batch", help="Batch job class", type=str, required=True, dest="batch_class")
+        parser.add_argument("-q", "--log-queue", help="log through a background queue of given size (0 = synchronous)", type=int, default=0, dest="log_queue_size")
+        parser.add_argument("--import-profile", help="report import time breakdown of the batch class module", action="store_true", dest="import_profile")
+        parser.add_argument("--import-budget", help="warn if the import time exceeds this budget (ms)", type=float, default=None, dest="import_budget")
+        parser.add_argument("--metrics", help="JSON file receiving phase timings", type=str, default=None, dest="metrics_file")
+        parser.add_argument("--profile", help="profile batch execution", choices=[ PROFILE_CPU, PROFILE_MEM ], default=None, dest="profile")
+        parser.add_argument("--profile-top", help="entries in the profile report", type=int, default=25, dest="profile_top")
+        parser.add_argument("--profile-output", help="profile report file (default: log)", type=str, default=None, dest="profile_output")
+        parser.add_argument("--fanout", help="JSONL file with one partition context per line", type=str, default=None, dest="fanout_file")
+        parser.add_argument("-j", "--jobs", help="maximum concurrent partitions in fan-out mode", type=int, default=None, dest="jobs")
         parser.add_argument("args", nargs=REMAINDER)
         
         opts = Wrap(vars(parser.parse_args()))
         
         config = None
+        log_queue = None
+        timer = PhaseTimer()
+        profile = None
+        
+        if (opts.profile is not None):
+            profile = { "kind" : opts.profile, "top" : opts.profile_top, "output" : opts.profile_output }
         
         # load new logger configuration from file
         if (opts.log_config_file is not None):
-            try:
-                logging.debug(
-                    "Loading new logger configuration from file '{0}'".format(opts.log_config_file))
-                
-                # apply new configuration
-                logging.config.fileConfig(opts.log_config_file)
-                logging.info(
-                    "New logger configuration applied from file '{0}'".format(opts.log_config_file))
-            except Exception as ex:
-                logging.error(
-                    "Cannot apply new logger configuration from file '{0}'".format(opts.log_config_file))
-                
-                raise RuntimeError(
-                    "Configuration error: Cannot apply new logger configuration from file '{0}'".format(opts.log_config_file), ex)
+            with timer.phase("log_config"):
+                cls.load_log_config(opts.log_config_file)
+        
+        # move log handlers behind a queue, if requested
+        if (opts.log_queue_size > 0 and opts.fanout_file is not None):
+            logging.warning("Log queue is not available in fan-out mode: logging synchronously")
+        elif (opts.log_queue_size > 0):
+            log_queue = LogQueue(opts.log_queue_size).start()
+            
+            logging.info(
+                "Logging through background queue (size={0})".format(opts.log_queue_size))
         
         # load JSON configuration
         if (opts.json_config_file is not None):
-            try:
-                with open(opts.json_config_file, "rt") as f:
-                    config = json.load(f)
-                    
-                    if (not cls.validate(config)):
-                        logging.error(
-                            "Configuration not valid from file '{0}'".format(opts.json_config_file))
+            with timer.phase("config"):
+                config = cls.load_config(opts.json_config_file)
+        
+        # load Batch job class
+        if (opts.batch_class is not None):
+            if (opts.import_profile):
+                cls.report_import_profile(opts.batch_class.rpartition(".")[0], opts.import_budget)
+            
+            with timer.phase("class_import"):
+                batch_class = cls.load_class(opts.batch_class)
+        else:
+            raise RuntimeError("Configuration error: Batch class undeclared")
                         
-                        raise RuntimeError(
-                            "Configuration error: Configuration not valid from file '{0}'".format(opts.json_config_file))
+        if (opts.fanout_file is not None):
+            try:
+                partitions = BatchFanOut.read_partitions(opts.fanout_file)
+            except RuntimeError:
+                raise
             except Exception as ex:
-                logging.error(
-                    "Cannot load configuration from file '{0}'".format(opts.json_config_file))
-                
                 raise RuntimeError(
-                    "Configuration error: Cannot load configuration from file '{0}'".format(opts.json_config_file), ex)
+                    "Configuration error: Cannot load partitions from file '{0}'".format(opts.fanout_file), ex)
+            
+            return BatchFanOut(
+                config, opts.batch_class, batch_class, opts.args.to_object(), partitions,
+                jobs=opts.jobs, timer=timer, metrics_file=opts.metrics_file)
         
-         # load Batch job class
-        if (opts.batch_class is not None):
-            try:
-                dot = opts.batch_class.rfind(".")
+        return cls(
+            Wrap(config), opts.batch_class, batch_class, opts.args.to_object(),
+            log_queue=log_queue, timer=timer, profile=profile, metrics_file=opts.metrics_file)
+
+class BatchFanOut(object):
+    """
+    Runs the same batch class once per partition context, on a pool of at
+    most 'jobs' worker processes. Config and class are loaded only once.
+    """
+    
+    def __init__(self, config, batch_name, batch, args, partitions, jobs=None, timer=None, metrics_file=None):
+        self.name = config["name"]
+        self.batch_name = batch_name
+        self.config = config
+        self.batch = batch
+        self.logger = logging.getLogger(config["logger"])
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timer = timer or PhaseTimer()
+        self.metrics_file = metrics_file
+        self.results = list()
+        self.rc = None
+        
+        base = Wrap.prepare_context(args)
+        
+        self.partitions = [ dict(base, **partition) for partition in partitions ]
+    
+    
+    @staticmethod
+    def read_partitions(path):
+        partitions = list()
+        
+        with open(path, "rt") as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
                 
-                assert dot >= 0
+                if (not line):
+                    continue
                 
-                module_name = opts.batch_class[0:dot]
-                class_name = opts.batch_class[(dot+1):]
+                try:
+                    value = json.loads(line)
+                except ValueError:
+                    value = line.split()
                 
-                logging.debug("Loading class '{0}.{1}'".format(module_name, class_name))
-            
-                logging.debug("Loading module '{0}'...".format(module_name))
-                module = importlib.import_module(module_name)
+                if (isinstance(value, dict)):
+                    partitions.append(value)
+                elif (isinstance(value, list)):
+                    partitions.append(Wrap.prepare_context([ str(v) for v in value ]))
+                else:
+                    raise RuntimeError(
+                        "Configuration error: Unexpected partition at line {0} of '{1}'".format(n, path))
+        
+        return partitions
+    
+    
+    def __enter__(self):
+        self.logger.debug("Entering Context Manager...")
+        
+        return self
+    
+    
+    def execute(self):
+        self.logger.info(
+            "Batch \"{0}\" fanning out {1} partition(s) on {2} worker(s)".format(self.name, len(self.partitions), self.jobs))
+        
+        try:
+            mp_context = multiprocessing.get_context("fork")
+        except ValueError:
+            mp_context = None
+        
+        results = [ None ] * len(self.partitions)
+        
+        with self.timer.phase("execute"):
+            with cf.ProcessPoolExecutor(
+                    max_workers=self.jobs, mp_context=mp_context,
+                    initializer=_fanout_init, initargs=(self.config, self.batch_name, self.batch)) as pool:
+                futures = {
+                    pool.submit(_fanout_run, self.partitions[i]) : i for i in range(len(self.partitions)) }
                 
-                logging.debug("Loading class '{0}'...".format(class_name))
-                batch_class = eval(f"module.{class_name}")
+                for future in cf.as_completed(futures):
+                    i = futures[future]
+                    
+                    try:
+                        rc, error, duration = future.result()
+                    except Exception as ex:
+                        rc, error, duration = 1, "{0}: {1}".format(type(ex).__name__, ex), None
+                    
+                    results[i] = {
+                        "partition" : i,
+                        "context" : self.partitions[i],
+                        "rc" : rc,
+                        "error" : error,
+                        "duration_s" : duration
+                    }
+                    
+                    if (rc == 0):
+                        self.logger.info("Partition {0} completed: rc={1}".format(i, rc))
+                    else:
+                        self.logger.error("Partition {0} failed: rc={1}, error={2}".format(i, rc, error))
+        
+        self.results = results
+        failed = [ r for r in results if r["rc"] != 0 ]
+        
+        self.logger.info(
+            "Fan-out completed: {0} partition(s), {1} failed".format(len(results), len(failed)))
+        
+        self.rc = 1 if failed else 0
+        
+        return self.rc
+    
+    
+    def __exit__(self, *args):
+        self.logger.debug("Exiting Context Manager... (args={0})".format(args))
+        
+        self.timer.log(self.logger)
+        
+        if (self.metrics_file is not None):
+            try:
+                self.timer.write(
+                    self.metrics_file, name=self.name, batch=self.batch_name, rc=self.rc,
+                    partitions=self.results)
             except Exception as ex:
-                logging.error(
-                    "Cannot load batch class '{0}".format(opts.batch_class))
+                self.logger.warning("Cannot write metrics file '{0}': {1}".format(self.metrics_file, ex))
+
+
+class BatchJob(object):
+    """
+    Base class for batch jobs that stream records through chunks.
+    
+    Subclasses implement process_chunk() and, optionally, commit() and
+    records() (for generator sources). Config keys, all optional:
+    
+        source        { "type" : "file" | "jsonl" | "csv", "path" : ..., "header" : bool }
+        chunk_size    records per chunk (1000)
+        prefetch      chunks read ahead of processing (2)
+        workers       chunks processed concurrently, 0 = inline (0)
+        pool          "thread" or "process" ("thread")
+        checkpoint    file recording the last committed chunk
+    
+    Chunks are committed in order; after each commit the checkpoint is
+    rewritten atomically, so a restarted job resumes after the last
+    committed chunk. The checkpoint is removed when the job completes.
+    """
+    
+    SOURCE_FILE = "file"
+    SOURCE_JSONL = "jsonl"
+    SOURCE_CSV = "csv"
+    
+    _END = object()
+    
+    def __init__(self, config, context, logger):
+        self.config = config
+        self.context = context
+        self.logger = logger
+        
+        self.chunk_size = int(config.chunk_size or 1000)
+        self.prefetch = int(config.prefetch or 2)
+        self.workers = int(config.workers or 0)
+        self.pool = config.pool or "thread"
+        self.checkpoint = config.checkpoint
+    
+    
+    def records(self):
+        source = self.config.source
+        
+        if (source is None):
+            raise RuntimeError("Configuration error: BatchJob source undeclared")
+        
+        if (source.type == BatchJob.SOURCE_FILE):
+            with open(source.path, "rt") as f:
+                for line in f:
+                    yield line.rstrip("\n")
+        elif (source.type == BatchJob.SOURCE_JSONL):
+            with open(source.path, "rt") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        elif (source.type == BatchJob.SOURCE_CSV):
+            with open(source.path, "rt", newline="") as f:
+                reader = csv.DictReader(f) if source.header else csv.reader(f)
                 
-                raise RuntimeError(
-                    "Configuration error: Cannot load batch class '{0}'".format(opts.batch_class), ex)
+                for row in reader:
+                    yield row
         else:
-            raise RuntimeError("Configuration error: Batch class undeclared")
-                        
-        return cls(Wrap(config), opts.batch_class, batch_class, opts.args.to_object())
+            raise RuntimeError("Configuration error: Unexpected BatchJob source type '{0}'".format(source.type))
+    
+    
+    def process_chunk(self, chunk):
+        raise NotImplementedError("BatchJob subclasses must implement process_chunk()")
+    
+    
+    def commit(self, index, result):
+        pass
+    
+    
+    def load_checkpoint(self):
+        if (self.checkpoint is None or not os.path.exists(self.checkpoint)):
+            return { "chunk" : 0, "records" : 0 }
+        
+        with open(self.checkpoint, "rt") as f:
+            state = json.load(f)
+        
+        self.logger.info(
+            "Resuming from checkpoint '{0}': chunk {1}, {2} record(s) already committed".format(
+                self.checkpoint, state["chunk"], state["records"]))
+        
+        return state
+    
+    
+    def save_checkpoint(self, state):
+        if (self.checkpoint is None):
+            return
+        
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        fd, tmp = tempfile.mkstemp(prefix=".checkpoint-", dir=directory)
+        
+        try:
+            with os.fdopen(fd, "wt") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            os.replace(tmp, self.checkpoint)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            
+            raise
+    
+    
+    def _read_chunks(self, skip, chunks, stop):
+        try:
+            records = itertools.islice(self.records(), skip, None)
+            
+            while not stop.is_set():
+                chunk = list(itertools.islice(records, self.chunk_size))
+                
+                if not chunk:
+                    break
+                
+                chunks.put(chunk)
+        except BaseException as ex:
+            chunks.put(ex)
+        finally:
+            chunks.put(BatchJob._END)
+    
+    
+    def _chunks(self, skip):
+        chunks = queue.Queue(maxsize=max(1, self.prefetch))
+        stop = threading.Event()
+        
+        reader = threading.Thread(
+            name="BatchJobReader", target=self._read_chunks, args=(skip, chunks, stop), daemon=True)
+        reader.start()
+        
+        try:
+            while True:
+                chunk = chunks.get()
+                
+                if chunk is BatchJob._END:
+                    break
+                elif isinstance(chunk, BaseException):
+                    raise chunk
+                
+                yield chunk
+        finally:
+            stop.set()
+            
+            # unblock the reader if it is waiting on a full queue
+            while reader.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+    
+    
+    def _executor(self):
+        if (self.workers <= 0):
+            return None
+        elif (self.pool == "process"):
+            try:
+                mp_context = multiprocessing.get_context("fork")
+            except ValueError:
+                mp_context = None
+            
+            return cf.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=mp_context,
+                initializer=_job_init, initargs=(self,))
+        else:
+            return cf.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="BatchJob")
+    
+    
+    def execute(self):
+        state = self.load_checkpoint()
+        index = state["chunk"]
+        committed = state["records"]
+        
+        executor = self._executor()
+        pending = collections.deque()
+        
+        def commit_next():
+            nonlocal index, committed
+            
+            size, future = pending.popleft()
+            result = future.result() if isinstance(future, cf.Future) else future
+            
+            self.commit(index, result)
+            
+            index += 1
+            committed += size
+            
+            self.save_checkpoint({ "chunk" : index, "records" : committed })
+            self.logger.debug("Chunk {0} committed ({1} record(s) so far)".format(index - 1, committed))
+        
+        try:
+            for chunk in self._chunks(committed):
+                if executor is None:
+                    pending.append((len(chunk), self.process_chunk(chunk)))
+                elif self.pool == "process":
+                    pending.append((len(chunk), executor.submit(_job_run, chunk)))
+                else:
+                    pending.append((len(chunk), executor.submit(self.process_chunk, chunk)))
+                
+                while len(pending) > max(0, self.workers):
+                    commit_next()
+            
+            while pending:
+                commit_next()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+        
+        self.logger.info("BatchJob completed: {0} chunk(s), {1} record(s)".format(index, committed))
+        
+        if (self.checkpoint is not None and os.path.exists(self.checkpoint)):
+            os.unlink(self.checkpoint)
+        
+        return 0
+
+
+_job = None
+
+
+def _job_init(job):
+    global _job
+    
+    _job = job
+
+
+def _job_run(chunk):
+    return _job.process_chunk(chunk)
+
+
+_fanout_state = None
+
+
+def _fanout_init(config, batch_name, batch):
+    global _fanout_state
+    
+    _fanout_state = (config, batch_name, batch)
+
+
+def _fanout_run(context):
+    config, batch_name, batch = _fanout_state
+    start = time.time()
+    
+    try:
+        with Batch(Wrap(config), batch_name, batch, context) as b:
+            rc = b.execute()
+        
+        return rc, None, time.time() - start
+    except Exception as ex:
+        return 1, "{0}: {1}".format(type(ex).__name__, ex), time.time() - start
+
 
 if (__name__ == "__main__"):
     logging.info("Program starting...")
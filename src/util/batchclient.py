@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:05:12 2026
+
+@author: pasquale
+"""
+
+import json
+import os
+import socket
+import sys
+
+from argparse import ArgumentParser, REMAINDER
+
+DEFAULT_SOCKET = "batchserver.sock"
+
+# environment variables passed on to the batch, on both sides of the socket
+ENV_KEYS = ("PATH", "HOME", "USER", "LOGNAME", "LANG", "LANGUAGE", "TZ", "TMPDIR", "CONFIGPATH")
+ENV_PREFIXES = ("LC_",)
+
+
+def filter_env(environ, keys=ENV_KEYS, prefixes=ENV_PREFIXES):
+    keys = frozenset(keys)
+    prefixes = tuple(prefixes)
+
+    return { k : v for k, v in environ.items() if (k in keys or k.startswith(prefixes)) }
+
+
+class Channel(object):
+    """
+    JSON-lines messages over a connected socket: every message is an object
+    with a 'type' ("log", "stdout", "stderr" or "exit") and a 'data' field.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+
+    def send(self, type, data, **extra):
+        message = dict(extra)
+        message["type"] = type
+        message["data"] = data
+
+        self._sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def receive(self):
+        line = self._reader.readline()
+
+        return json.loads(line.decode("utf-8")) if line else None
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self._sock.close()
+
+
+class BatchClient(object):
+
+    def __init__(self, socket_path, env_keys=ENV_KEYS):
+        self._socket_path = socket_path
+        self._env_keys = tuple(env_keys)
+
+    def run(self, batch_class, json_config_file, args, log=None, stdout=None, stderr=None):
+        log = log or sys.stderr
+        stdout = stdout or sys.stdout
+        stderr = stderr or sys.stderr
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+
+        channel = Channel(sock)
+
+        try:
+            sock.sendall((json.dumps({
+                "batch_class" : batch_class,
+                "config" : os.path.abspath(json_config_file),
+                "args" : list(args),
+                "cwd" : os.getcwd(),
+                "env" : filter_env(os.environ, self._env_keys)
+            }) + "\n").encode("utf-8"))
+
+            while True:
+                message = channel.receive()
+
+                if message is None:
+                    # the child died without reporting an exit code
+                    return 1
+                elif message["type"] == "exit":
+                    return message["data"]
+                elif message["type"] == "log":
+                    print(message["data"], file=log)
+                elif message["type"] == "stdout":
+                    stdout.write(message["data"])
+                elif message["type"] == "stderr":
+                    stderr.write(message["data"])
+        finally:
+            channel.close()
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="util.batchclient")
+    parser.add_argument("-s", "--socket", help="server Unix socket", type=str, default=DEFAULT_SOCKET, dest="socket_path")
+    parser.add_argument("-c", "--config", help="JSON config file", type=str, default="config.json", dest="json_config_file")
+    parser.add_argument("-b", "--batch", help="Batch job class", type=str, required=True, dest="batch_class")
+    parser.add_argument("-e", "--env", help="extra environment variable to pass on", action="append", default=list(), dest="env")
+    parser.add_argument("args", nargs=REMAINDER)
+
+    opts = parser.parse_args(argv)
+
+    return BatchClient(opts.socket_path, ENV_KEYS + tuple(opts.env)).run(opts.batch_class, opts.json_config_file, opts.args)
+
+
+if (__name__ == "__main__"):
+    sys.exit(main())
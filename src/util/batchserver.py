@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:47:31 2026
+
+@author: pasquale
+"""
+
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from argparse import ArgumentParser
+
+from .batch import Batch
+from .batchclient import Channel, DEFAULT_SOCKET, ENV_KEYS, ENV_PREFIXES, filter_env
+from .common import Wrap
+
+# seconds a client has to send its request before it is dropped
+REQUEST_TIMEOUT = 5.0
+MAX_REQUEST_SIZE = 1 << 20
+
+
+class _SocketLogHandler(logging.Handler):
+
+    def __init__(self, channel, formatter=None):
+        super(_SocketLogHandler, self).__init__()
+        self._channel = channel
+
+        if formatter is not None:
+            self.setFormatter(formatter)
+
+    def emit(self, record):
+        try:
+            self._channel.send("log", self.format(record), level=record.levelno)
+        except Exception:
+            self.handleError(record)
+
+
+class _StreamProxy(object):
+
+    def __init__(self, channel, name):
+        self._channel = channel
+        self._name = name
+
+    def write(self, data):
+        if data:
+            self._channel.send(self._name, data)
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class BatchServer(object):
+    """
+    Resident process that keeps batch configurations and modules loaded and
+    runs every request in a forked child, streaming its log back to the client.
+    Requests are read without blocking, so a slow client never holds up the
+    others; only the ENV_KEYS (and ENV_PREFIXES) client variables are applied.
+    """
+
+    def __init__(self, socket_path, batch_cls=Batch, env_keys=ENV_KEYS, env_prefixes=ENV_PREFIXES):
+        self._socket_path = os.path.abspath(socket_path)
+        self._batch_cls = batch_cls
+        self._env_keys = tuple(env_keys)
+        self._env_prefixes = tuple(env_prefixes)
+        self._configs = dict()
+        self._classes = dict()
+        self._children = set()
+        self._running = False
+        self._listener = None
+        self._selector = None
+        self._pending = dict()
+        self._logger = logging.getLogger(__name__)
+
+    @property
+    def running(self):
+        return self._running
+
+    def get_config(self, json_config_file):
+        path = os.path.abspath(json_config_file)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._configs.get(path)
+
+        if cached is None or cached[0] != stamp:
+            self._logger.info(f"Loading configuration '{path}'")
+
+            cached = (stamp, self._batch_cls.load_config(path))
+            self._configs[path] = cached
+
+        return cached[1]
+
+    def get_class(self, batch_class):
+        klass = self._classes.get(batch_class)
+
+        if klass is None:
+            self._logger.info(f"Loading batch class '{batch_class}'")
+
+            klass = self._batch_cls.load_class(batch_class)
+            self._classes[batch_class] = klass
+
+        return klass
+
+    def _reap(self):
+        for pid in list(self._children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+
+            if done:
+                self._children.discard(pid)
+
+    def _run_child(self, channel, request, config, klass):
+        os.chdir(request.get("cwd") or os.getcwd())
+
+        if request.get("env") is not None:
+            os.environ.update({
+                k : str(v) for k, v in filter_env(request["env"], self._env_keys, self._env_prefixes).items() })
+
+        for logger in [ logging.getLogger() ] + [
+                l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)]:
+            if logger.handlers:
+                logger.addHandler(_SocketLogHandler(channel, logger.handlers[0].formatter))
+
+        sys.stdout = _StreamProxy(channel, "stdout")
+        sys.stderr = _StreamProxy(channel, "stderr")
+
+        try:
+            batch = self._batch_cls(Wrap(config), request["batch_class"], klass, request.get("args") or list())
+
+            with batch as b:
+                rc = b.execute()
+        except Exception as ex:
+            self._logger.error(f"Cannot run batch '{request.get('batch_class')}': {ex}")
+            traceback.print_exc()
+
+            rc = 1
+
+        logging.shutdown()
+
+        channel.send("exit", rc)
+
+        return rc
+
+    def handle(self, conn, line):
+        channel = Channel(conn)
+
+        try:
+            if line is None:
+                raise RuntimeError("request timed out")
+
+            request = json.loads(line.decode("utf-8"))
+            config = self.get_config(request["config"])
+            klass = self.get_class(request["batch_class"])
+        except Exception as ex:
+            self._logger.error(f"Invalid batch request: {ex}")
+
+            try:
+                channel.send("stderr", f"Invalid batch request: {ex}\n")
+                channel.send("exit", 1)
+            except OSError:
+                pass
+            finally:
+                channel.close()
+
+            return
+
+        pid = os.fork()
+
+        if pid == 0:
+            rc = 1
+
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+                self._listener.close()
+                self._selector.close()
+
+                for pending in self._pending:
+                    pending.close()
+
+                rc = self._run_child(channel, request, config, klass)
+            except BaseException:
+                traceback.print_exc(file=sys.__stderr__)
+            finally:
+                os._exit(rc if isinstance(rc, int) and 0 <= rc < 256 else 1)
+        else:
+            self._children.add(pid)
+
+            self._logger.debug(f"Batch '{request['batch_class']}' running in child {pid}")
+
+            channel.close()
+
+    def _accept(self):
+        try:
+            conn, _ = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+
+        conn.setblocking(False)
+
+        self._pending[conn] = (time.monotonic() + REQUEST_TIMEOUT, bytearray())
+        self._selector.register(conn, selectors.EVENT_READ)
+
+    def _release(self, conn):
+        self._selector.unregister(conn)
+        conn.setblocking(True)
+
+        return self._pending.pop(conn)[1]
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+
+        buffer = self._pending[conn][1]
+        buffer.extend(data)
+
+        if (data and b"\n" not in data and len(buffer) < MAX_REQUEST_SIZE):
+            return
+
+        self.handle(conn, bytes(self._release(conn)))
+
+    def _expire(self):
+        now = time.monotonic()
+
+        for conn, (deadline, _) in list(self._pending.items()):
+            if deadline < now:
+                self._release(conn)
+                self.handle(conn, None)
+
+    def stop(self, *args):
+        self._running = False
+
+    def serve_forever(self):
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # the socket runs arbitrary batches: only its owner may connect
+        umask = os.umask(0o177)
+
+        try:
+            self._listener.bind(self._socket_path)
+        finally:
+            os.umask(umask)
+
+        os.chmod(self._socket_path, 0o600)
+
+        self._listener.listen(64)
+        self._listener.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+
+        signal.signal(signal.SIGTERM, self.stop)
+
+        self._running = True
+        self._logger.info(f"BatchServer listening on '{self._socket_path}'")
+
+        try:
+            while self._running:
+                for key, _ in self._selector.select(timeout=1.0):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    else:
+                        self._read(key.fileobj)
+
+                self._expire()
+                self._reap()
+        except KeyboardInterrupt:
+            self._logger.info("BatchServer interrupted")
+        finally:
+            self._running = False
+
+            for conn in list(self._pending):
+                self._release(conn)
+                conn.close()
+
+            self._selector.close()
+            self._listener.close()
+
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+
+            self._logger.info("BatchServer stopped")
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="util.batchserver")
+    parser.add_argument("-s", "--socket", help="server Unix socket", type=str, default=DEFAULT_SOCKET, dest="socket_path")
+    parser.add_argument("-l", "--log-config", help="logger config file", type=str, default="logging.conf", dest="log_config_file")
+    parser.add_argument("-p", "--preload", help="batch class to import at startup", action="append", default=list(), dest="preload")
+    parser.add_argument("-e", "--env", help="extra client environment variable to apply", action="append", default=list(), dest="env")
+
+    opts = parser.parse_args(argv)
+
+    if opts.log_config_file is not None:
+        Batch.load_log_config(opts.log_config_file)
+
+    server = BatchServer(opts.socket_path, env_keys=ENV_KEYS + tuple(opts.env))
+
+    for batch_class in opts.preload:
+        server.get_class(batch_class)
+
+    server.serve_forever()
+
+    return 0
+
+
+if (__name__ == "__main__"):
+    sys.exit(main())
@@ -6,17 +6,335 @@ Created on Mon Dec 11 14:41:53 2017
 @author: pasquale
 """
 
+import ast
+import builtins
+import io
 import json
+import os
 import re
+import threading
+import time
 
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from types import MappingProxyType
 from os import getenv
-from urllib.request import urlopen
+from urllib.parse import urlparse
+from urllib.request import urlopen, url2pathname
 
 NO_EVAL         = 0
 EVALUATE_SIMPLE = 1
 EVALUATE_EVAL   = 2
 
+class IncludeCache(object):
+    """
+    Process-wide cache of parsed JSON documents keyed by resolved URL.
+    
+    Entries for 'file:' URLs stay valid while the file keeps the same mtime
+    and size; entries for other schemes expire after 'ttl' seconds. At most
+    'maxsize' documents are kept (least recently used are evicted first).
+    Concurrent misses on the same URL share a single load. Cached documents
+    are shared between callers and must not be modified.
+    """
+    
+    def __init__(self, maxsize=128, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+        self._hits = 0
+        self._misses = 0
+    
+    @property
+    def stats(self):
+        return { "hits" : self._hits, "misses" : self._misses, "size" : len(self._entries) }
+    
+    @staticmethod
+    def resolve(url):
+        parsed = urlparse(url)
+        
+        if (parsed.scheme == "file"):
+            path = os.path.abspath(url2pathname(parsed.netloc + parsed.path))
+            
+            return "file:" + path, path
+        else:
+            return url, None
+    
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def _lookup(self, key, path):
+        entry = self._entries.get(key)
+        
+        if (entry is None):
+            return None
+        
+        stamp, expires, data = entry
+        
+        if (path is not None):
+            try:
+                valid = (stamp == self._stamp(path))
+            except OSError:
+                valid = False
+        else:
+            valid = (time.monotonic() < expires)
+        
+        if (valid):
+            self._entries.move_to_end(key)
+            
+            return entry
+        else:
+            del self._entries[key]
+            
+            return None
+    
+    def get(self, url, loader):
+        key, path = self.resolve(url)
+        
+        with self._lock:
+            entry = self._lookup(key, path)
+            
+            if (entry is not None):
+                self._hits += 1
+                
+                return entry[2]
+            
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            with self._lock:
+                entry = self._lookup(key, path)
+                
+                if (entry is not None):
+                    self._hits += 1
+                    
+                    return entry[2]
+            
+            # stat before reading, so a concurrent rewrite invalidates the entry
+            stamp = self._stamp(path) if path is not None else None
+            data = loader(url)
+            
+            with self._lock:
+                self._misses += 1
+                self._entries[key] = (stamp, time.monotonic() + self.ttl, data)
+                self._entries.move_to_end(key)
+                
+                while len(self._entries) > self.maxsize:
+                    old_key, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(old_key, None)
+            
+            return data
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+
+_include_cache = IncludeCache()
+
+def _load_json(url):
+    with urlopen(url) as connection:
+        return json.load(connection)
+
+_PATH_RE = re.compile(r"\.?([^.\[\]]+)|\[(\d+)\]")
+_NUMBER_END_RE = re.compile(r"[,\]\}\s]")
+
+class JsonStream(object):
+    """
+    Incremental reader over a JSON text stream: values are decoded one at
+    a time with JSONDecoder.raw_decode from a buffer refilled on demand, and
+    skipped values are scanned without being built.
+    """
+    
+    def __init__(self, reader, chunk_size=65536):
+        self._reader = reader
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+    
+    def _fill(self, size=None):
+        if (self._eof):
+            return False
+        
+        data = self._reader.read(size or self._chunk_size)
+        
+        if (not data):
+            self._eof = True
+            
+            return False
+        
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        
+        return True
+    
+    def peek(self):
+        while True:
+            buf = self._buf
+            pos = self._pos
+            
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            
+            self._pos = pos
+            
+            if (pos < len(buf)):
+                return buf[pos]
+            elif (not self._fill()):
+                return None
+    
+    def expect(self, char):
+        found = self.peek()
+        
+        if (found != char):
+            raise ValueError("JSON stream: expected '{0}', found '{1}'".format(char, found))
+        
+        self._pos += 1
+    
+    def decode(self):
+        c = self.peek()
+        
+        if (c is not None and (c == "-" or c.isdigit())):
+            # a number is complete only once its delimiter has been read
+            while not _NUMBER_END_RE.search(self._buf, self._pos) and self._fill():
+                pass
+        
+        size = self._chunk_size
+        
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                
+                self._pos = end
+                
+                return value
+            except json.JSONDecodeError:
+                if (not self._fill(size)):
+                    raise
+            
+            size *= 2
+    
+    def skip(self):
+        if (self.peek() not in ("{", "[")):
+            self.decode()
+            
+            return
+        
+        depth = 0
+        in_string = False
+        escape = False
+        
+        while True:
+            buf = self._buf
+            pos = self._pos
+            
+            while pos < len(buf):
+                c = buf[pos]
+                pos += 1
+                
+                if (in_string):
+                    if (escape):
+                        escape = False
+                    elif (c == "\\"):
+                        escape = True
+                    elif (c == '"'):
+                        in_string = False
+                elif (c == '"'):
+                    in_string = True
+                elif (c in "{["):
+                    depth += 1
+                elif (c in "}]"):
+                    depth -= 1
+                    
+                    if (depth == 0):
+                        self._pos = pos
+                        
+                        return
+            
+            self._pos = pos
+            
+            if (not self._fill()):
+                raise ValueError("JSON stream: unexpected end of document")
+    
+    def seek_path(self, path):
+        for match in _PATH_RE.finditer(path or ""):
+            key, index = match.groups()
+            
+            if (key is not None):
+                self._seek_key(key)
+            else:
+                self._seek_index(int(index))
+    
+    def _seek_key(self, key):
+        self.expect("{")
+        
+        while self.peek() != "}":
+            name = self.decode()
+            
+            self.expect(":")
+            
+            if (name == key):
+                return
+            
+            self.skip()
+            
+            if (self.peek() == ","):
+                self._pos += 1
+        
+        raise KeyError(key)
+    
+    def _seek_index(self, index):
+        self.expect("[")
+        
+        for i in range(index):
+            if (self.peek() == "]"):
+                raise IndexError(index)
+            
+            self.skip()
+            
+            if (self.peek() == ","):
+                self._pos += 1
+        
+        if (self.peek() == "]"):
+            raise IndexError(index)
+    
+    def iter_array(self):
+        self.expect("[")
+        
+        if (self.peek() == "]"):
+            self._pos += 1
+            
+            return
+        
+        while True:
+            yield self.decode()
+            
+            c = self.peek()
+            self._pos += 1
+            
+            if (c == "]"):
+                return
+            elif (c != ","):
+                raise ValueError("JSON stream: expected ',' or ']', found '{0}'".format(c))
+
+_INCLUDE = 3
+_MISSING = object()
+
+def _raw_keys(name):
+    # raw keys a logical name may come from, in lookup order
+    return (name, "[" + name + "]", "[[" + name + "]]", "@" + name)
+
 class WrapIter(object):
+    
+    __slots__ = ("_iter", "context", "evaluate")
+    
     def __init__(self, iter, context, evaluate):
         self._iter = iter
         self.context = context
@@ -37,16 +355,30 @@ class WrapIter(object):
             raise StopIteration
         
 class Wrap(object):
+    """
+    Attribute access to a JSON-like tree. Names are resolved through an
+    index checked against the wrapped object on every read, so changes made
+    to it (through a Wrap or directly) are always seen. Nested dicts and
+    lists come back as cached child Wraps, shared by the reads of the same
+    key until their context is rebound.
+    """
+    
+    __slots__ = ("_obj", "context", "evaluate", "_index", "_children")
     
     _default_context = dict()
+    _load_stats = { "count" : 0, "seconds" : 0.0 }
     
     def __init__(self, obj, context=None, evaluate=NO_EVAL):
         self._obj = obj
         self.context = context or Wrap._default_context
         self.evaluate = evaluate
+        self._index = None
+        # raw key -> child Wrap, for attribute and item reads
+        self._children = dict()
     
     def bind_context(self, context):
         self.context = context
+        self._children = dict()
     
     def get_context(self):
         return self.context
@@ -69,28 +401,108 @@ class Wrap(object):
             else:
                 return value
     
+    def _build_index(self):
+        # logical name -> (raw key, evaluation mode, raw keys that would take
+        # precedence), following the lookup order: "name", "[name]",
+        # "[[name]]", "@name"
+        index = dict()
+        ranked = dict()
+        
+        for k in self._obj:
+            if (not isinstance(k, str)):
+                continue
+            
+            candidates = [ (k, NO_EVAL) ]
+            
+            if (k[:1] == "[" and k[-1:] == "]" and len(k) >= 2):
+                candidates.append((k[1:-1], EVALUATE_SIMPLE))
+            
+            if (k[:2] == "[[" and k[-2:] == "]]" and len(k) >= 4):
+                candidates.append((k[2:-2], EVALUATE_EVAL))
+            
+            if (k[:1] == "@"):
+                candidates.append((k[1:], _INCLUDE))
+            
+            for name, mode in candidates:
+                if (name not in ranked or mode < ranked[name]):
+                    ranked[name] = mode
+                    index[name] = (k, mode, _raw_keys(name)[:mode] if mode else ())
+        
+        self._index = index
+        
+        return index
+    
     def __getattr__(self, name):
+        if (name[:2] == "__" or name in _WRAP_SLOTS):
+            raise AttributeError(name)
+        
+        return self._lookup(name)
+    
+    def _lookup(self, name):
+        # resolve a logical name against the data only, whatever attributes
+        # or methods of Wrap it may shadow
         try:
-            evaluate = NO_EVAL
-            
-            if (name in self._obj):
-                value = self._obj.get(name)
-            elif ("[{0}]".format(name) in self._obj):
-                value = self._obj.get("[{0}]".format(name))
-                evaluate = EVALUATE_SIMPLE
-            elif ("[[{0}]]".format(name) in self._obj):
-                value = self._obj.get("[[{0}]]".format(name))
-                evaluate = EVALUATE_EVAL
-            elif ("@{0}".format(name) in self._obj):
+            obj = self._obj
+            index = self._index
+            
+            if (index is None):
+                if (not isinstance(obj, dict)):
+                    return None
+                
+                index = self._build_index()
+            
+            entry = index.get(name)
+            
+            if (entry is None):
+                # a miss costs the plain probes; the index is rebuilt only
+                # when a key was added after it
+                if (name not in obj and "[" + name + "]" not in obj and "[[" + name + "]]" not in obj and "@" + name not in obj):
+                    return None
+                
+                entry = self._build_index()[name]
+            
+            key, evaluate, shadows = entry
+            value = obj.get(key, _MISSING)
+            
+            if (value is _MISSING or (shadows and any(k in obj for k in shadows))):
+                entry = self._build_index().get(name)
+                
+                if (entry is None):
+                    return None
+                
+                key, evaluate, _ = entry
+                value = obj[key]
+            
+            if (evaluate == _INCLUDE):
                 return Wrap.load(
-                    self["@{0}".format(name)].url, 
-                    self["@{0}".format(name)].root)
-            else:
-                value = None
+                    self[key].url, 
+                    self[key].root)
             
-            return Wrap.return_value(value, evaluate, self.context)
+            if (not isinstance(value, (dict, list))):
+                return evaluate_string(value, self.context, evaluate == EVALUATE_EVAL) if (evaluate and isinstance(value, str)) else value
+            
+            # inlined _child: index keys are always strings
+            child = self._children.get(key)
+            
+            if (child is None or child._obj is not value or child.context is not self.context or child.evaluate != evaluate):
+                child = Wrap(value, self.context, evaluate)
+                self._children[key] = child
+            
+            return child
         except Exception as ex:
             return None
+    
+    def _child(self, key, value, evaluate):
+        if (not isinstance(value, (dict, list)) or not isinstance(key, (str, int))):
+            return Wrap.return_value(value, evaluate, self.context)
+        
+        child = self._children.get(key)
+        
+        if (child is None or child._obj is not value or child.context is not self.context or child.evaluate != evaluate):
+            child = Wrap(value, self.context, evaluate)
+            self._children[key] = child
+        
+        return child
 
     def __len__(self):
         return len(self._obj)
@@ -100,12 +512,16 @@ class Wrap(object):
         
     def __getitem__(self, key):
         try:
-            value = self._obj[key]
-            
-            return Wrap.return_value(value, self.evaluate, self.context)
+            return self._child(key, self._obj[key], self.evaluate)
         except Exception as ex:
             return None
     
+    def __setitem__(self, key, value):
+        self._obj[key] = value
+    
+    def __delitem__(self, key):
+        del self._obj[key]
+    
     def __repr__(self):
         return repr(self._obj)
 
@@ -149,6 +565,16 @@ class Wrap(object):
         else:
             raise TypeError("Wrapped object is not a list")
     
+    def freeze(self, context=None):
+        """
+        Resolve the whole tree once with the given context (default: the
+        bound one), following includes and evaluating every key, into an
+        immutable FrozenWrap of read-only mappings and tuples.
+        """
+        context = self.context if context is None else context
+        
+        return _freeze(Wrap(self._obj, context, self.evaluate), context)
+    
     @staticmethod
     def prepare_context(args):
         context = dict()
@@ -164,37 +590,296 @@ class Wrap(object):
         return context
     
     
+    @staticmethod
+    def load_stats():
+        return dict(Wrap._load_stats)
+    
+    @staticmethod
+    def include_cache():
+        return _include_cache
+    
     @classmethod
     def load(cls, url, root=None, context=None, evaluate=NO_EVAL):
-        connection = urlopen(url)
+        start = time.perf_counter()
         
-        with connection:
-            data = cls(json.load(connection), context, evaluate)
+        data = cls(_include_cache.get(url, _load_json), context, evaluate)
         
-        connection.close()
+        Wrap._load_stats["count"] += 1
+        Wrap._load_stats["seconds"] += time.perf_counter() - start
         
         if root:
             return eval(f"data.{root}")
         else:
             return data
+    
+    @staticmethod
+    def iterload(url, path=None, context=None, evaluate=NO_EVAL, chunk_size=65536):
+        """
+        Yield the elements of the JSON array found at 'path' (e.g.
+        "tasklist" or "data.items[0]", raw keys) one at a time, without
+        loading the whole document; each element is wrapped like a Wrap
+        item. Includes are not followed and the include cache is bypassed.
+        """
+        context = context if context is not None else Wrap._default_context
+        
+        with urlopen(url) as connection:
+            stream = JsonStream(io.TextIOWrapper(connection, encoding="utf-8"), chunk_size)
+            stream.seek_path(path)
+            
+            for value in stream.iter_array():
+                yield Wrap.return_value(value, evaluate, context)
 
 
-def evaluate_string(pattern, context, evaluate=True):
+_WRAP_SLOTS = frozenset(Wrap.__slots__)
+
+
+class FrozenWrap(Mapping):
+    """
+    Read-only snapshot produced by Wrap.freeze(): a mapping with attribute
+    access (missing names read as None, as with Wrap), safe to share
+    between threads and cheap to pickle. Keys named like a method (keys,
+    items, get...) are read with frozen[key]: the mapping protocol is never
+    shadowed.
+    """
+    
+    __slots__ = ("_map",)
+    
+    def __init__(self, data):
+        object.__setattr__(self, "_map", MappingProxyType(dict(data)))
     
-    def replace_context(match):
-        var_name = re.search("\$\{([A-Za-z0-9_]+)\}", match.group(0)).group(1)
+    def __getattr__(self, name):
+        if (name[:2] == "__" or name == "_map"):
+            raise AttributeError(name)
         
-        return str(context.get(var_name))
+        return self._map.get(name)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenWrap is read-only")
+    
+    def __delattr__(self, name):
+        raise AttributeError("FrozenWrap is read-only")
     
-    def replace_env(match):
-        var_name = re.search("\$\[([A-Za-z0-9_]+)\]", match.group(0)).group(1)
+    def __getitem__(self, key):
+        return self._map[key]
+    
+    def __iter__(self):
+        return iter(self._map)
+    
+    def __len__(self):
+        return len(self._map)
+    
+    def __repr__(self):
+        return "FrozenWrap({0!r})".format(dict(self._map))
+    
+    def __reduce__(self):
+        return (FrozenWrap, (dict(self._map),))
+    
+    def to_dict(self):
+        return dict(self._map)
+
+def _freeze_value(value):
+    if (isinstance(value, dict)):
+        return FrozenWrap({ k : _freeze_value(v) for k, v in value.items() })
+    elif (isinstance(value, (list, tuple))):
+        return tuple(_freeze_value(v) for v in value)
+    else:
+        return value
+
+def _freeze(wrap, context):
+    if (not isinstance(wrap, Wrap)):
+        return _freeze_value(wrap)
+    
+    if (wrap.context is not context):
+        # included trees come back bound to the default context
+        wrap = Wrap(wrap._obj, context, wrap.evaluate)
+    
+    obj = wrap._obj
+    
+    if (isinstance(obj, dict)):
+        result = dict()
+        
+        for k in obj.keys():
+            if (not isinstance(k, str)):
+                result[k] = _freeze_value(obj[k])
+                
+                continue
+            
+            if (k[:2] == "[[" and k[-2:] == "]]"):
+                name = k[2:-2]
+            elif (k[:1] == "[" and k[-1:] == "]"):
+                name = k[1:-1]
+            elif (k[:1] == "@"):
+                name = k[1:]
+            else:
+                name = k
+            
+            if (name in result):
+                continue
+            
+            result[name] = _freeze(wrap._lookup(name), context)
+        
+        return FrozenWrap(result)
+    elif (isinstance(obj, list)):
+        return tuple(_freeze(wrap[i], context) for i in range(len(obj)))
+    else:
+        return _freeze_value(obj)
+
+_CONTEXT_RE = re.compile(r"\$\{([A-Za-z0-9_]+)\}")
+_ENV_RE = re.compile(r"\$\[([A-Za-z0-9_]+)\]")
+_OPEN_ENV_RE = re.compile(r"\$(\[[A-Za-z0-9_]*)?\Z")
+
+_SEG_LITERAL = 0
+_SEG_CONTEXT = 1
+_SEG_ENV     = 2
+
+class CompiledTemplate(object):
+    """
+    A pattern parsed once into literal, '${ctx}' and '$[ENV]' segments.
+    
+    Rendering gives the same result as substituting context variables
+    first and environment variables afterwards over the whole string; the
+    few patterns where the two passes could interact (a context value or a
+    literal/slot boundary that forms a new '$[ENV]' placeholder) are
+    rendered through the two-pass substitution.
+    """
+    
+    __slots__ = ("pattern", "_segments", "_safe")
+    
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._segments = list()
+        self._safe = True
+        
+        pieces = _CONTEXT_RE.split(pattern)
+        
+        for i, piece in enumerate(pieces):
+            if (i % 2 == 1):
+                self._segments.append((_SEG_CONTEXT, piece))
+                
+                continue
+            
+            env_pieces = _ENV_RE.split(piece)
+            
+            for j, env_piece in enumerate(env_pieces):
+                if (j % 2 == 1):
+                    self._segments.append((_SEG_ENV, env_piece))
+                elif (env_piece):
+                    self._segments.append((_SEG_LITERAL, env_piece))
+            
+            # a '$' or '$[NAME' right before a context slot may combine with
+            # the substituted value into an environment placeholder
+            if (i + 1 < len(pieces) and _OPEN_ENV_RE.search(env_pieces[-1])):
+                self._safe = False
+        
+        self._segments = tuple(self._segments)
+    
+    @property
+    def is_constant(self):
+        return all(kind == _SEG_LITERAL for kind, _ in self._segments)
+    
+    def render(self, context):
+        if (not self._safe):
+            return _substitute(self.pattern, context)
+        
+        parts = list()
         
-        return str(getenv(var_name))
+        for kind, value in self._segments:
+            if (kind == _SEG_LITERAL):
+                parts.append(value)
+            elif (kind == _SEG_CONTEXT):
+                value = str(context.get(value))
+                
+                if ("$" in value):
+                    return _substitute(self.pattern, context)
+                
+                parts.append(value)
+            else:
+                parts.append(str(getenv(value)))
+        
+        return "".join(parts)
+
+@lru_cache(maxsize=1024)
+def compile_template(pattern):
+    return CompiledTemplate(pattern)
+
+def _substitute(pattern, context):
+    s_context = _CONTEXT_RE.sub(lambda match: str(context.get(match.group(1))), pattern)
+    
+    return _ENV_RE.sub(lambda match: str(getenv(match.group(1))), s_context)
+
+_IMMUTABLE_TYPES = (int, float, complex, str, bytes, bool, type(None))
+
+def _is_immutable(value):
+    if (isinstance(value, _IMMUTABLE_TYPES)):
+        return True
+    elif (isinstance(value, (tuple, frozenset))):
+        return all(_is_immutable(v) for v in value)
+    else:
+        return False
+
+class CompiledExpression(object):
+    """
+    A Python expression compiled once into a code object and evaluated
+    against a namespace holding only the builtins and the given names.
+    Expressions made only of literals whose value is immutable are
+    evaluated at compile time and never run again.
+    """
     
-    s_context = re.sub("\$\{[A-Za-z0-9_]+\}", replace_context, pattern)
-    s = re.sub("\$\[[A-Za-z0-9_]+\]", replace_env, s_context)
+    __slots__ = ("source", "_code", "_constant", "_value")
+    
+    _globals = { "__builtins__" : builtins }
+    
+    def __init__(self, source):
+        self.source = source
+        self._code = None
+        self._constant = False
+        self._value = None
+        
+        try:
+            value = ast.literal_eval(source)
+            
+            if (_is_immutable(value)):
+                self._constant = True
+                self._value = value
+                
+                return
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            pass
+        
+        self._code = compile(source, "<expression>", "eval")
+        
+        if (not self._code.co_names):
+            # no names referenced: the result depends on literals only
+            try:
+                value = eval(self._code, dict(CompiledExpression._globals))
+                
+                if (_is_immutable(value)):
+                    self._constant = True
+                    self._value = value
+            except Exception:
+                pass
+    
+    @property
+    def is_constant(self):
+        return self._constant
+    
+    def evaluate(self, namespace=None):
+        if (self._constant):
+            return self._value
+        else:
+            return eval(self._code, dict(CompiledExpression._globals), namespace or dict())
+
+@lru_cache(maxsize=1024)
+def compile_expression(source):
+    return CompiledExpression(source)
+
+def evaluate_expression(source, namespace=None):
+    return compile_expression(source).evaluate(namespace)
+
+def evaluate_string(pattern, context, evaluate=True):
+    s = compile_template(pattern).render(context)
     
     if (evaluate):
-        return eval(s)
+        return evaluate_expression(s, { "context" : context })
     else:
         return s
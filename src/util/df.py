@@ -5,87 +5,1287 @@ Created on Tue Feb 26 13:06:31 2019
 @author: CAPUANO-P
 """
 
+import array
+import bisect
+import heapq
+import itertools
 import operator
+import pickle
+import tempfile
 
 from collections import OrderedDict
 
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+def _in(a, b):
+    try:
+        return a in b
+    except TypeError:
+        # unhashable value against a frozenset: compare one by one, as the
+        # membership test on a list would
+        return any(v is a or v == a for v in b)
+
+def _not_in(a, b):
+    return not _in(a, b)
+
+def _between(a, bounds):
+    return bounds[0] <= a <= bounds[1]
+
 _OP_MAP = {
     "=" : operator.eq,
     "<" : operator.lt,
     "<=" : operator.le,
     ">" : operator.gt,
     ">=" : operator.ge,
-    "!=" : operator.ne
+    "!=" : operator.ne,
+    "in" : _in,
+    "not in" : _not_in,
+    "is" : operator.is_,
+    "is not" : operator.is_not,
+    "between" : _between
+}
+
+_OP_SOURCE = {
+    "=" : "{0} == {1}",
+    "<" : "{0} < {1}",
+    "<=" : "{0} <= {1}",
+    ">" : "{0} > {1}",
+    ">=" : "{0} >= {1}",
+    "!=" : "{0} != {1}",
+    "in" : "{0} in {1}",
+    "not in" : "{0} not in {1}",
+    "is" : "{0} is {1}",
+    "is not" : "{0} is not {1}",
+    "between" : "{1}[0] <= {0} <= {1}[1]"
 }
 
-def filter_df(data, *conditions):
-    
-    def check(row, condition):
-        if len(condition) == 2:
-            return row[condition[0]] == condition[1]
-        elif len(condition) == 3:
-            op = _OP_MAP.get(condition[1])
-            
-            if op:
-                return op(row[condition[0]], row[condition[2]])
+# operators always taking a literal operand, never a column
+_LITERAL_OPS = ( "in", "not in", "is", "is not", "between" )
+
+# static selectivity estimate: most selective conditions run first
+_OP_RANK = {
+    "=" : 0,
+    "is" : 0,
+    "in" : 1,
+    "between" : 2,
+    "<" : 3,
+    "<=" : 3,
+    ">" : 3,
+    ">=" : 3,
+    "!=" : 4,
+    "is not" : 4,
+    "not in" : 4
+}
+
+
+class Literal(object):
+    """
+    Marks the operand of a 3-tuple condition as a value instead of a column.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return "lit({0!r})".format(self.value)
+
+def lit(value):
+    return Literal(value)
+
+def _unwrap(value):
+    return value.value if isinstance(value, Literal) else value
+
+def _parse_condition(condition):
+    """
+    Normalize a condition to (column, operator, operand, operand_is_column):
+    (col, value), (col, op, col2), (col, op, lit(value)),
+    (col, "in" | "not in", values), (col, "is" | "is not", value) and
+    (col, "between", low, high), bounds included.
+    """
+    if len(condition) == 2:
+        return condition[0], "=", _unwrap(condition[1]), False
+    elif len(condition) == 3:
+        op = condition[1]
+
+        if not isinstance(op, str) or op not in _OP_MAP or op == "between":
+            raise RuntimeError("Wrong condition: {0}".format(condition))
+
+        if isinstance(condition[2], Literal):
+            operand, by_column = condition[2].value, False
+        elif op in _LITERAL_OPS:
+            operand, by_column = condition[2], False
+        else:
+            operand, by_column = condition[2], True
+
+        if op in ("in", "not in") and not isinstance(operand, str):
+            try:
+                operand = frozenset(operand)
+            except TypeError:
+                operand = tuple(operand)
+
+        return condition[0], op, operand, by_column
+    elif len(condition) == 4 and condition[1] == "between":
+        return condition[0], "between", (_unwrap(condition[2]), _unwrap(condition[3])), False
+    else:
+        raise RuntimeError("Unexpected condition: {0}".format(condition))
+
+
+_REORDER_MIN_ROWS = 1000
+_REORDER_SAMPLE = 256
+
+
+class Predicate(object):
+    """
+    Conditions compiled once into a single row function that stops at the
+    first failing condition; the most selective conditions are tested first.
+    A Predicate can be reused across calls and passed wherever conditions
+    are accepted.
+    """
+
+    def __init__(self, *conditions):
+        parsed = list()
+
+        for condition in conditions:
+            if isinstance(condition, Predicate):
+                parsed.extend(condition.conditions)
             else:
-                raise RuntimeError("Wrong condition: {0}".format(condition))
+                parsed.append(_parse_condition(condition))
+
+        self._conditions = sorted(parsed, key=lambda c: _OP_RANK[c[1]])
+        self._func = self._compile()
+
+    @staticmethod
+    def _of(parsed):
+        predicate = Predicate.__new__(Predicate)
+        predicate._conditions = list(parsed)
+        predicate._func = predicate._compile()
+
+        return predicate
+
+    @property
+    def conditions(self):
+        return list(self._conditions)
+
+    def _compile(self):
+        if not self._conditions:
+            return lambda row: True
+
+        names = list()
+        terms = list()
+
+        for i, (idx, op, operand, by_column) in enumerate(self._conditions):
+            names.extend([ f"k{i}", f"v{i}" ])
+
+            right = f"row[v{i}]" if by_column else f"v{i}"
+            terms.append("(" + _OP_SOURCE[op].format(f"row[k{i}]", right) + ")")
+
+        if any(op in ("in", "not in") and isinstance(operand, frozenset) for _, op, operand, _ in self._conditions):
+            # hashing an unhashable value raises: retry the row the slow way
+            body = "try:\n            return {0}\n        except TypeError:\n            return slow(row)".format(
+                " and ".join(terms))
         else:
-            raise RuntimeError("Unexpected condition: {0}".format(condition))
-    
-    return [row for row in data if all([check(row, condition) for condition in conditions])]
-
-def sort_df(data, *keys):
-    
-    def key(idx):    
-        def inner_key(row):
-            return row[idx]
-        
-        return inner_key
-    
-    if len(keys) == 0:
-        return data
+            body = "return {0}".format(" and ".join(terms))
+
+        source = "def factory(slow, {0}):\n    def predicate(row):\n        {1}\n    return predicate\n".format(
+            ", ".join(names), body)
+
+        namespace = dict()
+        exec(compile(source, "<predicate>", "exec"), namespace)
+
+        values = list()
+
+        for idx, _, operand, _ in self._conditions:
+            values.extend([ idx, operand ])
+
+        return namespace["factory"](self._slow, *values)
+
+    def _slow(self, row):
+        for idx, op, operand, by_column in self._conditions:
+            if not _OP_MAP[op](row[idx], row[operand] if by_column else operand):
+                return False
+
+        return True
+
+    def reorder(self, rows):
+        """
+        Order the conditions by the share of the sample rows they let
+        through, lowest first, and recompile.
+        """
+        rows = list(rows)
+
+        if len(self._conditions) < 2 or not rows:
+            return self
+
+        def passed(condition):
+            idx, op, operand, by_column = condition
+            func = _OP_MAP[op]
+
+            try:
+                return sum(1 for row in rows if func(row[idx], row[operand] if by_column else operand))
+            except Exception:
+                return len(rows)
+
+        self._conditions = sorted(self._conditions, key=passed)
+        self._func = self._compile()
+
+        return self
+
+    def __call__(self, row):
+        return self._func(row)
+
+
+def _parse_sort_key(k):
+    if isinstance(k, int):
+        return k, False
+    elif isinstance(k, list) or isinstance(k, tuple):
+        if len(k) == 1:
+            return k[0], False
+        elif len(k) == 2:
+            return k[0], k[1]
+        else:
+            raise RuntimeError("Unexpected sort key: {0}".format(k))
+    else:
+        raise RuntimeError("Unexpected sort key: {0}".format(k))
+
+def _parse_maps(maps):
+    identity = lambda x: x
+
+    new_maps = OrderedDict()
+
+    for map in maps:
+        if isinstance(map, int):
+            new_maps[map] = identity
+        elif isinstance(map, list) or isinstance(map, tuple):
+            if (len(map) == 2):
+                new_maps[map[0]] = map[1]
+            else:
+                raise RuntimeError("Unexpected map: {0}".format(map))
+        else:
+            raise RuntimeError("Unexpected map: {0}".format(map))
+
+    return new_maps, identity
+
+def _make_column(values):
+    """
+    Store homogeneous int or float values in a typed array (NumPy when
+    available, array.array otherwise); anything else stays a list.
+    """
+    if not isinstance(values, list):
+        values = list(values)
+
+    kinds = set(map(type, values))
+
+    try:
+        if (kinds == { int }):
+            return _np.array(values, dtype=_np.int64) if _np is not None else array.array("q", values)
+        elif (kinds == { float }):
+            return _np.array(values, dtype=_np.float64) if _np is not None else array.array("d", values)
+    except OverflowError:
+        pass
+
+    return values
+
+def _is_ndarray(column):
+    return _np is not None and isinstance(column, _np.ndarray)
+
+def _gather(column, indices):
+    if _is_ndarray(column):
+        return column[indices]
+
+    if _is_ndarray(indices):
+        indices = indices.tolist()
+
+    if isinstance(column, array.array):
+        return array.array(column.typecode, map(column.__getitem__, indices))
     else:
-        tmp = data
-        
-        for k in keys[-1::-1]:
-            if isinstance(k, int):
-                tmp = sorted(tmp, key=key(k))
-            elif isinstance(k, list) or isinstance(k, tuple):
-                if len(k) == 1:
-                    tmp = sorted(tmp, key=key(k[0]))
-                elif len(k) == 2:
-                    tmp = sorted(tmp, key=key(k[0]), reverse=k[1])
+        return list(map(column.__getitem__, indices))
+
+def _is_number(value):
+    return isinstance(value, (int, float))
+
+_NUMPY_OPS = ( "=", "<", "<=", ">", ">=", "!=" )
+
+def _to_list(column):
+    return column if isinstance(column, list) else column.tolist()
+
+
+class Table(object):
+    """
+    Column oriented data set: every column is stored once, as a typed array
+    when its values allow it, and filter / sort / map / select return new
+    tables built from boolean masks and index gathers instead of row copies.
+    """
+
+    def __init__(self, columns, length=None):
+        self._columns = [ c if isinstance(c, array.array) or _is_ndarray(c) else _make_column(c) for c in columns ]
+
+        if length is None:
+            length = len(self._columns[0]) if self._columns else 0
+
+        for c in self._columns:
+            if len(c) != length:
+                raise RuntimeError("Column length mismatch: {0} != {1}".format(len(c), length))
+
+        self._length = length
+
+    @staticmethod
+    def from_rows(rows, width=None):
+        rows = rows if isinstance(rows, list) else list(rows)
+
+        if width is None:
+            width = len(rows[0]) if rows else 0
+
+        return Table([ _make_column([ row[i] for row in rows ]) for i in range(width) ], len(rows))
+
+    def to_rows(self):
+        if not self._columns:
+            return [ list() for _ in range(self._length) ]
+
+        return [ list(row) for row in zip(*[ _to_list(c) for c in self._columns ]) ]
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @property
+    def width(self):
+        return len(self._columns)
+
+    def column(self, idx):
+        return self._columns[idx]
+
+    def row(self, idx):
+        return [ _to_list(c[idx:idx + 1])[0] for c in self._columns ]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self.to_rows())
+
+    def take(self, indices):
+        if not _is_ndarray(indices) and not isinstance(indices, list):
+            indices = list(indices)
+
+        return Table([ _gather(c, indices) for c in self._columns ], len(indices))
+
+    def _mask(self, idx, op, operand, by_column):
+        column = self._columns[idx]
+        func = _OP_MAP[op]
+
+        if _is_ndarray(column):
+            if by_column:
+                if _is_ndarray(self._columns[operand]) and op in _NUMPY_OPS:
+                    return func(column, self._columns[operand])
+            elif op in _NUMPY_OPS and _is_number(operand):
+                return func(column, operand)
+            elif op == "between" and all(map(_is_number, operand)):
+                return (column >= operand[0]) & (column <= operand[1])
+            elif op in ("in", "not in") and all(map(_is_number, operand)):
+                return _np.isin(column, list(operand), invert=(op == "not in"))
+
+        if by_column:
+            return list(map(func, _to_list(column), _to_list(self._columns[operand])))
+        else:
+            return list(map(func, _to_list(column), itertools.repeat(operand)))
+
+    def positions(self, *conditions):
+        """
+        Indices of the rows matching all the conditions, in row order.
+        """
+        parsed = Predicate(*conditions).conditions
+
+        if not parsed:
+            return list(range(self._length))
+
+        masks = [ self._mask(*p) for p in parsed ]
+
+        if _np is not None:
+            mask = _np.asarray(masks[0], dtype=bool)
+
+            for m in masks[1:]:
+                mask = mask & _np.asarray(m, dtype=bool)
+
+            return _np.flatnonzero(mask)
+        else:
+            mask = masks[0]
+
+            for m in masks[1:]:
+                mask = list(map(operator.and_, map(bool, mask), map(bool, m)))
+
+            return list(itertools.compress(range(self._length), mask))
+
+    def filter(self, *conditions):
+        if not conditions:
+            return self
+
+        return self.take(self.positions(*conditions))
+
+    def argsort(self, *keys):
+        """
+        Stable permutation ordering the rows by the given keys, with the
+        same key syntax and tie semantics as sort_df.
+        """
+        parsed = [ _parse_sort_key(k) for k in keys ]
+        order = list(range(self._length))
+
+        for idx, reverse in parsed[-1::-1]:
+            column = self._columns[idx]
+
+            if _is_ndarray(column) and column.dtype.kind in "if":
+                order = _np.asarray(order, dtype=_np.int64)
+                values = column[order]
+
+                if reverse:
+                    # stable descending: sort the reversed values ascending and flip back
+                    perm = (len(values) - 1 - _np.argsort(values[::-1], kind="stable"))[::-1]
                 else:
-                    raise RuntimeError("Unexpected sort key: {0}".format(k))
+                    perm = _np.argsort(values, kind="stable")
+
+                order = order[perm]
+            else:
+                if _is_ndarray(order):
+                    order = order.tolist()
+
+                values = _to_list(column)
+                order = sorted(order, key=values.__getitem__, reverse=reverse)
+
+        return order
+
+    def sort(self, *keys, top_k=None):
+        if len(keys) == 0:
+            return self if top_k is None else self.take(range(min(top_k, self._length)))
+
+        order = self.argsort(*keys)
+
+        return self.take(order if top_k is None else order[:top_k])
+
+    def map(self, *maps):
+        if len(maps) == 0:
+            return self
+
+        new_maps, identity = _parse_maps(maps)
+
+        return Table([
+            self._columns[k] if f is identity else _make_column(map(f, _to_list(self._columns[k])))
+            for k, f in new_maps.items() ], self._length)
+
+    def select(self, *keys):
+        if len(keys) == 0:
+            return self
+
+        return Table([ self._columns[k] for k in keys ], self._length)
+
+
+def _column_values(data, column):
+    if isinstance(data, Table):
+        return _to_list(data.column(column))
+    else:
+        return [ row[column] for row in data ]
+
+
+class HashIndex(object):
+    """
+    Row positions grouped by the value of one column: answers '=', 'in' and
+    'is None' conditions on that column without scanning the data.
+    """
+
+    def __init__(self, data, column):
+        self._column = column
+        self._positions = dict()
+        self._size = 0
+
+        for value in _column_values(data, column):
+            self._add(value)
+
+    @property
+    def column(self):
+        return self._column
+
+    def __len__(self):
+        return self._size
+
+    def _add(self, value):
+        positions = self._positions.get(value)
+
+        if positions is None:
+            self._positions[value] = [ self._size ]
+        else:
+            positions.append(self._size)
+
+        self._size += 1
+
+    def append(self, row):
+        self._add(row[self._column])
+
+    def extend(self, rows):
+        for row in rows:
+            self._add(row[self._column])
+
+    def lookup(self, op, operand):
+        """
+        Sorted positions of the rows matching the condition, or None when
+        the condition cannot be answered by this index.
+        """
+        if op == "=" or (op == "is" and operand is None):
+            return list(self._positions.get(operand, ()))
+        elif op == "in" and isinstance(operand, frozenset):
+            return sorted(itertools.chain.from_iterable(self._positions.get(v, ()) for v in operand))
+        else:
+            return None
+
+
+class SortedIndex(object):
+    """
+    Values of one column kept sorted next to their row positions: answers
+    '=', '<', '<=', '>', '>=' and 'between' conditions by bisection, and
+    'is None' from the positions of the None values. The index does not
+    follow the data: rows added later must be passed to append or extend by
+    hand, and are merged in on the next lookup.
+    """
+
+    def __init__(self, data, column):
+        self._column = column
+        self._keys = list()
+        self._positions = list()
+        self._nones = list()
+        self._pending = list()
+
+        for value in _column_values(data, column):
+            self._add(value)
+
+    @property
+    def column(self):
+        return self._column
+
+    def __len__(self):
+        return len(self._positions) + len(self._nones) + len(self._pending)
+
+    def _add(self, value):
+        if value is None:
+            self._nones.append(len(self))
+        else:
+            self._pending.append((value, len(self)))
+
+    def append(self, row):
+        self._add(row[self._column])
+
+    def extend(self, rows):
+        for row in rows:
+            self._add(row[self._column])
+
+    def _merge(self):
+        # the pending rows are sorted on their own, then timsort merges the
+        # two sorted runs in linear time
+        first = operator.itemgetter(0)
+        merged = sorted(itertools.chain(zip(self._keys, self._positions), sorted(self._pending, key=first)), key=first)
+
+        self._keys = list(map(first, merged))
+        self._positions = list(map(operator.itemgetter(1), merged))
+        self._pending = list()
+
+    def _range(self, op, operand):
+        keys = self._keys
+
+        if op == "=":
+            return bisect.bisect_left(keys, operand), bisect.bisect_right(keys, operand)
+        elif op == "<":
+            return 0, bisect.bisect_left(keys, operand)
+        elif op == "<=":
+            return 0, bisect.bisect_right(keys, operand)
+        elif op == ">":
+            return bisect.bisect_right(keys, operand), len(keys)
+        elif op == ">=":
+            return bisect.bisect_left(keys, operand), len(keys)
+        elif op == "between":
+            return bisect.bisect_left(keys, operand[0]), bisect.bisect_right(keys, operand[1])
+        else:
+            return None
+
+    def lookup(self, op, operand):
+        """
+        Sorted positions of the rows matching the condition, or None when
+        the condition cannot be answered by this index.
+        """
+        if operand is None:
+            return list(self._nones) if op in ("=", "is") else None
+
+        if self._pending:
+            self._merge()
+
+        bounds = self._range(op, operand)
+
+        if bounds is None:
+            return None
+
+        return sorted(self._positions[bounds[0]:bounds[1]])
+
+
+def _index_lookup(data, conditions, indexes):
+    """
+    Positions matched by the most selective indexed condition, and the
+    conditions still to be checked on those rows.
+    """
+    parsed = Predicate(*conditions).conditions
+    best = None
+
+    for i, (idx, op, operand, by_column) in enumerate(parsed):
+        if by_column:
+            continue
+
+        for index in indexes:
+            if index.column != idx:
+                continue
+
+            if len(index) != len(data):
+                raise RuntimeError("Index on column {0} is out of date: {1} rows indexed, {2} in data".format(
+                    idx, len(index), len(data)))
+
+            positions = index.lookup(op, operand)
+
+            if positions is not None and (best is None or len(positions) < len(best[1])):
+                best = (i, positions)
+
+    if best is None:
+        return None, parsed
+
+    return best[1], parsed[:best[0]] + parsed[best[0] + 1:]
+
+def filter_df(data, *conditions, indexes=None):
+    """
+    Rows matching all the conditions. 'indexes' is a list of HashIndex or
+    SortedIndex built on 'data': when one of them answers a condition,
+    only the rows it returns are checked against the others.
+    """
+    if indexes:
+        positions, remaining = _index_lookup(data, conditions, indexes)
+
+        if positions is not None:
+            if isinstance(data, Table):
+                return data.take(positions).filter(Predicate._of(remaining))
             else:
-                raise RuntimeError("Unexpected sort key: {0}".format(k))
-        
+                return list(filter(Predicate._of(remaining)._func, map(data.__getitem__, positions)))
+
+    if isinstance(data, Table):
+        return data.filter(*conditions)
+
+    if len(conditions) == 1 and isinstance(conditions[0], Predicate):
+        predicate = conditions[0]
+    else:
+        predicate = Predicate(*conditions)
+
+        if isinstance(data, list) and len(data) > _REORDER_MIN_ROWS:
+            predicate.reorder(data[:_REORDER_SAMPLE])
+
+    return list(filter(predicate._func, data))
+
+_NUMERIC_TYPES = ( int, float )
+
+
+class _Reversed(object):
+    """
+    Sort key wrapper inverting the order of any comparable value, so that
+    mixed ascending / descending keys fit in a single composite key.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _composite_key(parsed, rows=None):
+    """
+    Single key function and reverse flag sorting by all the parsed keys at
+    once. With mixed directions the descending columns are negated when
+    'rows' shows they only hold numbers, and wrapped in _Reversed otherwise.
+    """
+    directions = set(bool(reverse) for _, reverse in parsed)
+
+    if len(directions) == 1:
+        return operator.itemgetter(*[ idx for idx, _ in parsed ]), (True in directions)
+
+    names = list()
+    terms = list()
+
+    for i, (idx, reverse) in enumerate(parsed):
+        names.append(f"k{i}")
+
+        if not reverse:
+            terms.append(f"row[k{i}]")
+        elif rows is not None and all(type(row[idx]) in _NUMERIC_TYPES for row in rows):
+            terms.append(f"-row[k{i}]")
+        else:
+            terms.append(f"R(row[k{i}])")
+
+    source = "def factory(R, {0}):\n    return lambda row: ({1},)\n".format(", ".join(names), ", ".join(terms))
+
+    namespace = dict()
+    exec(compile(source, "<sort key>", "exec"), namespace)
+
+    return namespace["factory"](_Reversed, *[ idx for idx, _ in parsed ]), False
+
+def _top_k(rows, keys, n):
+    """
+    First n rows of sort_df(rows, *keys), kept in a heap of size n.
+    """
+    if n <= 0:
+        return list()
+
+    key, reverse = _composite_key([ _parse_sort_key(k) for k in keys ], rows if isinstance(rows, list) else None)
+
+    return (heapq.nlargest if reverse else heapq.nsmallest)(n, rows, key=key)
+
+def sort_df(data, *keys, top_k=None):
+    """
+    Stable sort on all the keys; with 'top_k' only the first top_k rows are
+    kept, selected in a single pass with a bounded heap. See
+    external_sort_df for data sets that do not fit in memory.
+    """
+    if isinstance(data, Table):
+        return data.sort(*keys, top_k=top_k)
+
+    if len(keys) == 0:
+        return data if top_k is None else list(itertools.islice(data, top_k))
+    elif top_k is not None:
+        return _top_k(data, keys, top_k)
+    else:
+        # one stable in-place pass per key on a single copy: CPython compares
+        # homogeneous int / float / str keys much faster than composite tuples
+        tmp = list(data)
+
+        for idx, reverse in [ _parse_sort_key(k) for k in keys ][-1::-1]:
+            tmp.sort(key=operator.itemgetter(idx), reverse=reverse)
+
         return tmp
 
+def _spill(rows, block_size):
+    run = tempfile.TemporaryFile()
+
+    for i in range(0, len(rows), block_size):
+        pickle.dump(rows[i:i + block_size], run, pickle.HIGHEST_PROTOCOL)
+
+    run.seek(0)
+
+    return run
+
+def _read_run(run):
+    while True:
+        try:
+            block = pickle.load(run)
+        except EOFError:
+            return
+
+        yield from block
+
+def external_sort_df(data, *keys, run_size=100000, block_size=1000):
+    """
+    Sort an iterable of rows larger than the available memory: sorted runs
+    of run_size rows are spilled to temporary files and lazily merged.
+    Returns an iterator; the order is the same as sort_df.
+    """
+    if len(keys) == 0:
+        yield from data
+        return
+
+    key, reverse = _composite_key([ _parse_sort_key(k) for k in keys ])
+    rows = iter(data)
+    runs = list()
+
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, run_size))
+
+            if not chunk:
+                break
+
+            chunk.sort(key=key, reverse=reverse)
+
+            if not runs and len(chunk) < run_size:
+                # everything fits in a single run: nothing to spill
+                yield from chunk
+                return
+
+            runs.append(_spill(chunk, block_size))
+
+            del chunk
+
+        yield from heapq.merge(*[ _read_run(run) for run in runs ], key=key, reverse=reverse)
+    finally:
+        for run in runs:
+            run.close()
+
 def map_df(data, *maps):
+    if isinstance(data, Table):
+        return data.map(*maps)
+
     if len(maps) == 0:
         return data
     else:
-        identity = lambda x: x
-        
-        new_maps = OrderedDict()
-        
-        for map in maps:
-            if isinstance(map, int):
-                new_maps[map] = identity
-            elif isinstance(map, list) or isinstance(map, tuple):
-                if (len(map) == 2):
-                    new_maps[map[0]] = map[1]
-                else:
-                    raise RuntimeError("Unexpected map: {0}".format(map))
-            else:
-                raise RuntimeError("Unexpected map: {0}".format(map))
-        
+        new_maps, _ = _parse_maps(maps)
+
         return [ [new_maps[k](row[k]) for k in new_maps.keys()] for row in data ]
 
 def select_df(data, *keys):
+    if isinstance(data, Table):
+        return data.select(*keys)
+
     if len(keys) == 0:
         return data
     else:
         return [ [row[k] for k in keys] for row in data ]
+
+def _key_columns(keys):
+    if isinstance(keys, int):
+        return [ keys ]
+    elif isinstance(keys, list) or isinstance(keys, tuple):
+        return list(keys)
+    else:
+        raise RuntimeError("Unexpected key columns: {0}".format(keys))
+
+def _key_getter(columns):
+    """
+    Row key as a tuple of the given columns.
+    """
+    if len(columns) == 0:
+        return lambda row: ()
+    elif len(columns) == 1:
+        idx = columns[0]
+
+        return lambda row: (row[idx],)
+    else:
+        return operator.itemgetter(*columns)
+
+def join_df(left, right, left_keys, right_keys=None, how="inner"):
+    """
+    Hash join of two row lists on key columns (right_keys defaults to
+    left_keys): every result row is the left row followed by the right one,
+    padded with None for unmatched rows of a 'left' join. The hash table is
+    built on the smaller side; rows come out in left order, then right order.
+    """
+    if how not in ("inner", "left"):
+        raise RuntimeError("Unexpected join type: {0}".format(how))
+
+    left_columns = _key_columns(left_keys)
+    right_columns = _key_columns(right_keys if right_keys is not None else left_keys)
+
+    if len(left_columns) != len(right_columns):
+        raise RuntimeError("Join key mismatch: {0} and {1}".format(left_columns, right_columns))
+
+    left_key = _key_getter(left_columns)
+    right_key = _key_getter(right_columns)
+
+    if not hasattr(right, "__len__"):
+        right = list(right)
+
+    result = list()
+
+    if hasattr(left, "__len__") and len(left) < len(right):
+        # build on the left rows, probe with the right ones
+        left = left if isinstance(left, list) else list(left)
+        table = dict()
+
+        for i, row in enumerate(left):
+            table.setdefault(left_key(row), list()).append(i)
+
+        matches = [ None ] * len(left)
+
+        for row in right:
+            for i in table.get(right_key(row), ()):
+                if matches[i] is None:
+                    matches[i] = [ row ]
+                else:
+                    matches[i].append(row)
+
+        padding = None
+
+        for row, rows in zip(left, matches):
+            if rows is not None:
+                result.extend(list(row) + list(r) for r in rows)
+            elif how == "left":
+                padding = padding if padding is not None else [ None ] * _width(right)
+                result.append(list(row) + padding)
+    else:
+        # build on the right rows, probe with the left ones
+        table = dict()
+
+        for row in right:
+            table.setdefault(right_key(row), list()).append(row)
+
+        padding = [ None ] * _width(right)
+
+        for row in left:
+            rows = table.get(left_key(row))
+
+            if rows is not None:
+                result.extend(list(row) + list(r) for r in rows)
+            elif how == "left":
+                result.append(list(row) + padding)
+
+    return result
+
+def _width(rows):
+    for row in rows:
+        return len(row)
+
+    return 0
+
+
+class _Count(object):
+    """
+    Number of rows, or of non-None values when bound to a column.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value):
+        self.value += 1
+
+    def merge(self, other):
+        self.value += other.value
+
+    def result(self):
+        return self.value
+
+
+class _Sum(object):
+    __slots__ = ("value", "count")
+
+    def __init__(self):
+        self.value = 0
+        self.count = 0
+
+    def add(self, value):
+        self.value += value
+        self.count += 1
+
+    def merge(self, other):
+        self.value += other.value
+        self.count += other.count
+
+    def result(self):
+        return self.value if self.count else None
+
+
+class _Min(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def merge(self, other):
+        if other.value is not None:
+            self.add(other.value)
+
+    def result(self):
+        return self.value
+
+
+class _Max(_Min):
+    __slots__ = ()
+
+    def add(self, value):
+        if self.value is None or value > self.value:
+            self.value = value
+
+
+class _Mean(_Sum):
+    __slots__ = ()
+
+    def result(self):
+        return self.value / self.count if self.count else None
+
+
+class _Distinct(object):
+    """
+    Number of distinct values.
+    """
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values = set()
+
+    def add(self, value):
+        self.values.add(value)
+
+    def merge(self, other):
+        self.values |= other.values
+
+    def result(self):
+        return len(self.values)
+
+_AGGREGATES = {
+    "count" : _Count,
+    "sum" : _Sum,
+    "min" : _Min,
+    "max" : _Max,
+    "mean" : _Mean,
+    "distinct" : _Distinct
+}
+
+def _parse_aggregate(aggregate):
+    """
+    An aggregate is "count" / ("count",) for the number of rows, or
+    (name, col) with name among count, sum, min, max, mean and distinct;
+    None values are skipped by column aggregates.
+    """
+    if isinstance(aggregate, str):
+        aggregate = ( aggregate, )
+
+    if (isinstance(aggregate, list) or isinstance(aggregate, tuple)) and len(aggregate) in (1, 2):
+        factory = _AGGREGATES.get(aggregate[0])
+
+        if factory is None or (len(aggregate) == 1 and factory is not _Count):
+            raise RuntimeError("Wrong aggregate: {0}".format(aggregate))
+
+        return factory, aggregate[1] if len(aggregate) == 2 else None
+    else:
+        raise RuntimeError("Unexpected aggregate: {0}".format(aggregate))
+
+def _group(data, key, parsed):
+    """
+    Aggregate states by group key, in order of first appearance.
+    """
+    groups = dict()
+
+    for row in data:
+        k = key(row)
+        states = groups.get(k)
+
+        if states is None:
+            states = groups[k] = [ factory() for factory, _ in parsed ]
+
+        for state, (_, idx) in zip(states, parsed):
+            if idx is None:
+                state.add(row)
+            else:
+                value = row[idx]
+
+                if value is not None:
+                    state.add(value)
+
+    return groups
+
+def _merge_groups(target, groups):
+    for k, states in groups.items():
+        current = target.get(k)
+
+        if current is None:
+            target[k] = states
+        else:
+            for state, other in zip(current, states):
+                state.merge(other)
+
+    return target
+
+def _group_rows(groups):
+    return [ list(k) + [ state.result() for state in states ] for k, states in groups.items() ]
+
+def group_df(data, keys, *aggregates):
+    """
+    One row per distinct value of the key columns (in order of first
+    appearance): the key values followed by one value per aggregate,
+    computed in a single pass over the data.
+    """
+    parsed = [ _parse_aggregate(aggregate) for aggregate in aggregates ]
+
+    return _group_rows(_group(data, _key_getter(_key_columns(keys)), parsed))
+
+_WHERE = "where"
+_MAP = "map"
+_SELECT = "select"
+_ORDER_BY = "order_by"
+_LIMIT = "limit"
+_TOP_K = "top_k"
+
+_STREAMING = ( _WHERE, _MAP, _SELECT )
+
+
+def _compile_step(kind, args):
+    if kind == _WHERE:
+        return True, Predicate(*args)._func
+    elif kind == _MAP:
+        new_maps, _ = _parse_maps(args)
+        items = list(new_maps.items())
+
+        return False, lambda row: [ f(row[k]) for k, f in items ]
+    else:
+        return False, lambda row: [ row[k] for k in args ]
+
+def _fuse(rows, steps):
+    """
+    Run consecutive where / map / select steps in a single pass.
+    """
+    if not steps:
+        return rows
+
+    ops = [ _compile_step(kind, args) for kind, args in steps ]
+
+    def generate():
+        for row in rows:
+            for is_filter, f in ops:
+                if is_filter:
+                    if not f(row):
+                        break
+                else:
+                    row = f(row)
+            else:
+                yield row
+
+    return generate()
+
+
+class Query(object):
+    """
+    Lazy pipeline over a list of rows, any iterable of rows or a Table.
+    Steps are only recorded: the plan is optimized and run when the query
+    is iterated or collected.
+    """
+
+    def __init__(self, source, steps=()):
+        self._source = source
+        self._steps = tuple(steps)
+
+    def _add(self, kind, args):
+        return Query(self._source, self._steps + ((kind, args),))
+
+    def where(self, *conditions):
+        Predicate(*conditions)
+
+        return self._add(_WHERE, conditions) if conditions else self
+
+    def map(self, *maps):
+        _parse_maps(maps)
+
+        return self._add(_MAP, maps) if maps else self
+
+    def select(self, *keys):
+        return self._add(_SELECT, keys) if keys else self
+
+    def order_by(self, *keys):
+        for k in keys:
+            _parse_sort_key(k)
+
+        return self._add(_ORDER_BY, keys) if keys else self
+
+    def limit(self, n):
+        if (not isinstance(n, int) or n < 0):
+            raise RuntimeError("Unexpected limit: {0}".format(n))
+
+        return self._add(_LIMIT, n)
+
+    @property
+    def plan(self):
+        """
+        Optimized steps: filters move ahead of sorts, consecutive sorts and
+        limits merge, and a sort followed by a limit becomes a top-k.
+        """
+        steps = list()
+
+        for kind, args in self._steps:
+            if kind == _WHERE:
+                pos = len(steps)
+
+                # filtering commutes with a stable sort: filter first, sort less
+                while pos > 0 and steps[pos - 1][0] == _ORDER_BY:
+                    pos -= 1
+
+                steps.insert(pos, (kind, args))
+            elif kind == _ORDER_BY and steps and steps[-1][0] == _ORDER_BY:
+                steps[-1] = (_ORDER_BY, args + steps[-1][1])
+            elif kind == _LIMIT and steps and steps[-1][0] == _LIMIT:
+                steps[-1] = (_LIMIT, min(args, steps[-1][1]))
+            else:
+                steps.append((kind, args))
+
+        result = list()
+
+        for i, (kind, args) in enumerate(steps):
+            if kind == _LIMIT:
+                # map and select keep the row count: the limit can move before them
+                pos = len(result)
+
+                while pos > 0 and result[pos - 1][0] in (_MAP, _SELECT):
+                    pos -= 1
+
+                if pos > 0 and result[pos - 1][0] == _ORDER_BY:
+                    result[pos - 1] = (_TOP_K, (result[pos - 1][1], args))
+                else:
+                    result.insert(pos, (kind, args))
+            else:
+                result.append((kind, args))
+
+        return result
+
+    def _run_table(self, table):
+        for kind, args in self.plan:
+            if kind == _WHERE:
+                table = table.filter(*args)
+            elif kind == _MAP:
+                table = table.map(*args)
+            elif kind == _SELECT:
+                table = table.select(*args)
+            elif kind == _ORDER_BY:
+                table = table.sort(*args)
+            elif kind == _LIMIT:
+                table = table.take(range(min(args, len(table))))
+            elif kind == _TOP_K:
+                keys, n = args
+                table = table.sort(*keys, top_k=n)
+
+        return table
+
+    def _run(self):
+        rows = iter(self._source)
+        pending = list()
+
+        for kind, args in self.plan:
+            if kind in _STREAMING:
+                pending.append((kind, args))
+                continue
+
+            rows = _fuse(rows, pending)
+            pending = list()
+
+            if kind == _LIMIT:
+                rows = itertools.islice(rows, args)
+            elif kind == _ORDER_BY:
+                rows = iter(sort_df(list(rows), *args))
+            elif kind == _TOP_K:
+                rows = iter(_top_k(rows, *args))
+
+        yield from _fuse(rows, pending)
+
+    def __iter__(self):
+        if isinstance(self._source, Table):
+            return iter(self._run_table(self._source))
+        else:
+            return self._run()
+
+    def collect(self):
+        """
+        Run the query: a Table for Table sources, a list of rows otherwise.
+        """
+        if isinstance(self._source, Table):
+            return self._run_table(self._source)
+        else:
+            return list(self._run())
+
+
+def query(data):
+    return Query(data)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:52:36 2026
+
+@author: pasquale
+"""
+
+import array
+import csv
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+
+from .df import Predicate, Table, _np, _to_list
+
+COLUMNAR_MAGIC = b"PYDFCOL1"
+
+_TRAILER = struct.Struct("<Q8s")
+_ALIGN = 8
+
+_ARRAY = "array"
+_STR = "str"
+_JSON = "json"
+
+_NUMPY_TYPECODES = {
+    "i" : "q",
+    "f" : "d"
+}
+
+
+def _open_map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _resolve(names, column):
+    if names is None or isinstance(column, int):
+        return column
+
+    try:
+        return names.index(column)
+    except ValueError:
+        raise RuntimeError("Unknown column: {0}".format(column))
+
+
+def read_csv(path, columns=None, conditions=(), types=None, header=False, delimiter=",", quotechar='"', encoding="utf-8"):
+    """
+    Lazily read the rows of a memory mapped CSV file. Only the 'columns'
+    requested are kept (all of them by default), 'types' maps a column to
+    the function converting its values and rows not matching the
+    filter_df-style 'conditions' are dropped while reading. With 'header'
+    the first record names the columns, and names can replace indexes.
+    Short rows are padded with empty fields, left unconverted; a row missing
+    a column used by a condition never matches.
+    """
+    mm = _open_map(path)
+
+    if mm is None:
+        return
+
+    try:
+        # csv parses straight from the mapping, one line at a time: quoted
+        # fields spanning several lines are handled by the reader itself
+        reader = csv.reader(
+            (line.decode(encoding) for line in iter(mm.readline, b"")),
+            delimiter=delimiter, quotechar=quotechar)
+
+        names = None
+
+        if header:
+            for row in reader:
+                if row:
+                    names = row
+                    break
+
+        parsed = [
+            (_resolve(names, idx), op, _resolve(names, operand) if by_column else operand, by_column)
+            for idx, op, operand, by_column in Predicate(*conditions).conditions ]
+        predicate = Predicate._of(parsed)._func if parsed else None
+
+        projection = None if columns is None else [ _resolve(names, c) for c in columns ]
+        converters = [ (_resolve(names, k), f) for k, f in (types or dict()).items() ]
+
+        compared = [ idx for idx, _, _, _ in parsed ] + [ operand for _, _, operand, by_column in parsed if by_column ]
+        compared_width = max(compared) + 1 if compared else 0
+
+        needed = compared + [ k for k, _ in converters ] + (projection or list())
+        width = max(needed) + 1 if needed else 0
+
+        for row in reader:
+            if not row:
+                continue
+
+            present = len(row)
+
+            if present < width:
+                if present < compared_width:
+                    continue
+
+                row.extend([ "" ] * (width - present))
+
+            for k, f in converters:
+                if k < present:
+                    row[k] = f(row[k])
+
+            if predicate is not None and not predicate(row):
+                continue
+
+            yield row if projection is None else [ row[k] for k in projection ]
+    finally:
+        mm.close()
+
+
+def _column_kind(column):
+    if isinstance(column, array.array) and column.typecode in ("q", "d"):
+        return _ARRAY, column.typecode
+    elif _np is not None and isinstance(column, _np.ndarray) and column.dtype.kind in _NUMPY_TYPECODES and column.dtype.itemsize == 8:
+        return _ARRAY, _NUMPY_TYPECODES[column.dtype.kind]
+    elif all(isinstance(v, str) for v in column):
+        return _STR, None
+    else:
+        return _JSON, None
+
+
+def _pad(f):
+    position = f.tell()
+
+    if position % _ALIGN:
+        f.write(b"\0" * (_ALIGN - position % _ALIGN))
+
+    return f.tell()
+
+
+def write_columns(path, data, names=None):
+    """
+    Write a Table (or a list of rows) in the binary columnar format: int
+    and float columns as raw 8 byte arrays, string columns as UTF-8 data
+    plus offsets, anything else as JSON (so tuples come back as lists); a
+    JSON footer describes them. Nothing in the file is ever unpickled.
+    """
+    table = data if isinstance(data, Table) else Table.from_rows(data)
+    footer = {
+        "length" : len(table),
+        "byteorder" : sys.byteorder,
+        "names" : names,
+        "columns" : list()
+    }
+
+    with open(path, "wb") as f:
+        f.write(COLUMNAR_MAGIC)
+
+        for column in table.columns:
+            kind, typecode = _column_kind(column)
+            spec = { "kind" : kind }
+
+            if kind == _ARRAY:
+                spec["typecode"] = typecode
+                spec["offset"] = _pad(f)
+                f.write(memoryview(column if isinstance(column, array.array) else _np.ascontiguousarray(column)).cast("B"))
+            elif kind == _STR:
+                encoded = [ v.encode("utf-8") for v in column ]
+                offsets = array.array("q", itertools.accumulate(map(len, encoded), initial=0))
+
+                spec["offset"] = _pad(f)
+                f.write(memoryview(offsets).cast("B"))
+                spec["data"] = f.tell()
+                f.write(b"".join(encoded))
+            else:
+                try:
+                    encoded = json.dumps(_to_list(column), allow_nan=True).encode("utf-8")
+                except TypeError as ex:
+                    raise RuntimeError("Column {0} cannot be stored: {1}".format(len(footer["columns"]), ex))
+
+                spec["offset"] = _pad(f)
+                f.write(encoded)
+
+            spec["end"] = f.tell()
+            footer["columns"].append(spec)
+
+        encoded = json.dumps(footer).encode("utf-8")
+
+        f.write(encoded)
+        f.write(_TRAILER.pack(len(encoded), COLUMNAR_MAGIC))
+
+
+def _read_footer(mm):
+    if len(mm) < len(COLUMNAR_MAGIC) + _TRAILER.size or mm[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise RuntimeError("Not a columnar file")
+
+    size, magic = _TRAILER.unpack_from(mm, len(mm) - _TRAILER.size)
+
+    if magic != COLUMNAR_MAGIC:
+        raise RuntimeError("Truncated columnar file")
+
+    start = len(mm) - _TRAILER.size - size
+
+    return json.loads(mm[start:start + size].decode("utf-8"))
+
+
+def read_columns(path, columns=None):
+    """
+    Load a file written by write_columns as a Table, keeping only the
+    'columns' requested. Numeric columns map straight onto the file: NumPy
+    arrays are read-only views of the mapping, array.array columns are a
+    plain memory copy; no value is parsed.
+    """
+    mm = _open_map(path)
+
+    if mm is None:
+        raise RuntimeError("Not a columnar file")
+
+    footer = _read_footer(mm)
+    length = footer["length"]
+    names = footer.get("names")
+    swap = footer["byteorder"] != sys.byteorder
+
+    selected = range(len(footer["columns"])) if columns is None else [ _resolve(names, c) for c in columns ]
+    result = list()
+
+    for idx in selected:
+        spec = footer["columns"][idx]
+
+        if spec["kind"] == _ARRAY:
+            if _np is not None:
+                dtype = _np.dtype(spec["typecode"]).newbyteorder("<" if footer["byteorder"] == "little" else ">")
+                column = _np.frombuffer(mm, dtype=dtype, count=length, offset=spec["offset"])
+
+                result.append(column.astype(column.dtype.newbyteorder("=")) if swap else column)
+            else:
+                column = array.array(spec["typecode"])
+
+                with memoryview(mm) as view:
+                    column.frombytes(view[spec["offset"]:spec["end"]])
+
+                if swap:
+                    column.byteswap()
+
+                result.append(column)
+        elif spec["kind"] == _STR:
+            offsets = array.array("q")
+
+            with memoryview(mm) as view:
+                offsets.frombytes(view[spec["offset"]:spec["data"]])
+
+            if swap:
+                offsets.byteswap()
+
+            data = mm[spec["data"]:spec["end"]]
+            result.append([ data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(length) ])
+        elif spec["kind"] == _JSON:
+            result.append(json.loads(mm[spec["offset"]:spec["end"]].decode("utf-8")))
+        else:
+            raise RuntimeError("Unknown column kind: {0}".format(spec["kind"]))
+
+    if _np is None:
+        # nothing maps onto the file any more
+        mm.close()
+
+    return Table(result, length)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:05:12 2026
+
+@author: pasquale
+"""
+
+import array
+import concurrent.futures as cf
+import itertools
+import multiprocessing
+import os
+
+from multiprocessing import shared_memory
+
+from .df import (Predicate, Table, filter_df, group_df, map_df,
+                 _REORDER_MIN_ROWS, _REORDER_SAMPLE, _group, _group_rows, _key_columns,
+                 _key_getter, _make_column, _merge_groups, _np, _parse_aggregate, _parse_maps)
+
+PARALLEL_THRESHOLD = 100000
+
+_FILTER = "filter"
+_MAP = "map"
+_GROUP = "group"
+
+# worker side state, handed over by the pool initializer
+_state = None
+
+
+def _share_columns(table, blocks):
+    """
+    Copy the array backed columns of a Table into shared memory blocks
+    (appended to 'blocks'); list columns are inherited by the forked workers.
+    """
+    specs = list()
+
+    for column in table.columns:
+        if isinstance(column, array.array):
+            data = memoryview(column).cast("B")
+        elif _np is not None and isinstance(column, _np.ndarray):
+            data = memoryview(_np.ascontiguousarray(column)).cast("B")
+        else:
+            specs.append(("list", column))
+            continue
+
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        block.buf[:len(data)] = data
+        blocks.append(block)
+
+        if isinstance(column, array.array):
+            specs.append(("array", block.name, column.typecode, len(column)))
+        else:
+            specs.append(("numpy", block.name, column.dtype.str, len(column)))
+
+    return specs
+
+
+def _attach(spec):
+    if spec[0] == "list":
+        return spec
+
+    # forked workers share the parent's resource tracker, which already
+    # knows the block: the parent unlinks it once every chunk is done
+    return spec + (shared_memory.SharedMemory(name=spec[1]),)
+
+
+def _init(state):
+    global _state
+
+    if state.get("columns") is not None:
+        state["columns"] = [ _attach(spec) for spec in state["columns"] ]
+
+    _state = state
+
+
+def _slice_table(start, end):
+    columns = list()
+
+    for spec in _state["columns"]:
+        if spec[0] == "list":
+            columns.append(spec[1][start:end])
+        elif spec[0] == "array":
+            _, _, typecode, _, block = spec
+            column = array.array(typecode)
+            column.frombytes(block.buf[start * column.itemsize:end * column.itemsize])
+            columns.append(column)
+        else:
+            _, _, dtype, length, block = spec
+            columns.append(_np.ndarray((length,), dtype=dtype, buffer=block.buf)[start:end])
+
+    return Table(columns, end - start)
+
+
+def _run_chunk(task):
+    kind, start, end = task
+    data = _state["data"]
+
+    if data is None:
+        table = _slice_table(start, end)
+
+        if kind == _FILTER:
+            positions = table.positions(_state["predicate"])
+
+            return [ start + i for i in (positions.tolist() if _np is not None and isinstance(positions, _np.ndarray) else positions) ]
+        elif kind == _MAP:
+            return [ c if isinstance(c, list) else c.tolist() for c in table.map(*_state["maps"]).columns ]
+        else:
+            return _group(iter(table), _state["key"], _state["aggregates"])
+    else:
+        if kind == _FILTER:
+            predicate = _state["predicate"]._func
+
+            return [ i for i in range(start, end) if predicate(data[i]) ]
+        elif kind == _MAP:
+            mapper = _state["mapper"]
+
+            return [ mapper(row) for row in data[start:end] ]
+        else:
+            return _group(data[start:end], _state["key"], _state["aggregates"])
+
+
+def _run(kind, data, state, workers, chunk_size):
+    """
+    Run 'kind' on chunks of 'data' in a fork based process pool; results
+    come back in chunk order.
+    """
+    length = len(data)
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-length // (workers * 4)))
+
+    tasks = [ (kind, start, min(start + chunk_size, length)) for start in range(0, length, chunk_size) ]
+    blocks = list()
+
+    try:
+        if isinstance(data, Table):
+            state["data"] = None
+            state["columns"] = _share_columns(data, blocks)
+        else:
+            state["data"] = data
+
+        with cf.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                    initializer=_init, initargs=(state,)) as pool:
+            return list(pool.map(_run_chunk, tasks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def _serial(data, workers, threshold):
+    if not isinstance(data, (list, Table)):
+        data = list(data)
+
+    workers = workers or os.cpu_count() or 1
+
+    return data, workers, (workers <= 1 or len(data) < threshold)
+
+
+def parallel_filter_df(data, *conditions, workers=None, chunk_size=None, threshold=PARALLEL_THRESHOLD):
+    """
+    filter_df on chunks of the data spread over 'workers' processes; inputs
+    smaller than 'threshold' rows are filtered in the calling process.
+    """
+    data, workers, serial = _serial(data, workers, threshold)
+
+    if serial:
+        return filter_df(data, *conditions)
+
+    if len(conditions) == 1 and isinstance(conditions[0], Predicate):
+        predicate = conditions[0]
+    else:
+        predicate = Predicate(*conditions)
+
+        if isinstance(data, list) and len(data) > _REORDER_MIN_ROWS:
+            predicate.reorder(data[:_REORDER_SAMPLE])
+
+    results = _run(_FILTER, data, { "predicate" : predicate }, workers, chunk_size)
+    positions = list(itertools.chain.from_iterable(results))
+
+    if isinstance(data, Table):
+        return data.take(positions)
+    else:
+        return list(map(data.__getitem__, positions))
+
+
+def parallel_map_df(data, *maps, workers=None, chunk_size=None, threshold=PARALLEL_THRESHOLD):
+    """
+    map_df on chunks of the data spread over 'workers' processes.
+    """
+    data, workers, serial = _serial(data, workers, threshold)
+
+    if serial or len(maps) == 0:
+        return map_df(data, *maps)
+
+    new_maps, _ = _parse_maps(maps)
+    items = list(new_maps.items())
+
+    state = {
+        "maps" : maps,
+        "mapper" : lambda row: [ f(row[k]) for k, f in items ]
+    }
+
+    results = _run(_MAP, data, state, workers, chunk_size)
+
+    if isinstance(data, Table):
+        return Table([
+            _make_column(itertools.chain.from_iterable(chunk[i] for chunk in results))
+            for i in range(len(items)) ], len(data))
+    else:
+        return list(itertools.chain.from_iterable(results))
+
+
+def parallel_group_df(data, keys, *aggregates, workers=None, chunk_size=None, threshold=PARALLEL_THRESHOLD):
+    """
+    group_df computed as partial groupings per chunk, merged in chunk order
+    so that groups keep their order of first appearance.
+    """
+    data, workers, serial = _serial(data, workers, threshold)
+
+    if serial:
+        return group_df(data, keys, *aggregates)
+
+    state = {
+        "key" : _key_getter(_key_columns(keys)),
+        "aggregates" : [ _parse_aggregate(aggregate) for aggregate in aggregates ]
+    }
+
+    groups = dict()
+
+    for partial in _run(_GROUP, data, state, workers, chunk_size):
+        _merge_groups(groups, partial)
+
+    return _group_rows(groups)
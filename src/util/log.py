@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+
+@author: pasquale
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+
+from collections import OrderedDict
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_CACHE_SIZE = 1024
+
+# argument types whose text can never change between two calls
+_PRIMITIVES = (str, int, float, bool)
+
+
+class DropOldestQueue(queue.Queue):
+    """
+    Bounded queue that never blocks the producer: when full, the oldest
+    record is discarded to make room for the new one.
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        super(DropOldestQueue, self).__init__(maxsize)
+        self._dropped = 0
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def put(self, item, block=False, timeout=None):
+        with self.mutex:
+            if self.maxsize > 0 and self._qsize() >= self.maxsize:
+                # the evicted record will never be processed: account for it
+                # as done, or join() would wait for it forever
+                self._get()
+                self.unfinished_tasks -= 1
+                self._dropped += 1
+
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def put_nowait(self, item):
+        return self.put(item)
+
+
+def _cacheable(value):
+    if (value is None or type(value) in _PRIMITIVES):
+        return True
+
+    return (type(value) is tuple and all(_cacheable(v) for v in value))
+
+
+def _signature(value):
+    # 1, True and 1.0 are equal as keys but format differently
+    if (type(value) is tuple):
+        return tuple(_signature(v) for v in value)
+
+    return type(value)
+
+
+class CachingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that merges message and arguments through a small LRU,
+    so hot repeated messages are formatted only once. Only messages whose
+    arguments are immutable primitives are cached: any other object may
+    render differently from one call to the next.
+    """
+
+    def __init__(self, queue, cache_size=DEFAULT_CACHE_SIZE):
+        super(CachingQueueHandler, self).__init__(queue)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def _get_message(self, record):
+        if (not isinstance(record.msg, str) or not _cacheable(record.args)):
+            return record.getMessage()
+
+        key = (record.msg, record.args, _signature(record.args))
+
+        with self._cache_lock:
+            message = self._cache.get(key)
+
+            if message is not None:
+                self._cache.move_to_end(key)
+
+                return message
+
+        message = record.getMessage()
+
+        with self._cache_lock:
+            self._cache[key] = message
+
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return message
+
+    def prepare(self, record):
+        # same contract as QueueHandler.prepare: the record leaves this thread
+        # with its message merged, so the listener never touches user objects
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = self._get_message(record)
+        record.msg = record.message
+        record.args = None
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+
+        record.exc_info = None
+
+        return record
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener that drains up to 'batch_size' records per wake-up and
+    flushes the target handlers once per batch instead of once per record.
+    Records tagged with a route (the name of the logger that produced them)
+    are only handed to the handlers that logger owned.
+    """
+
+    def __init__(self, queue, *handlers, routes=None, batch_size=DEFAULT_BATCH_SIZE):
+        super(BatchQueueListener, self).__init__(queue, *handlers, respect_handler_level=True)
+        self._routes = routes or dict()
+        self._batch_size = batch_size
+
+    def _monitor(self):
+        q = self.queue
+        stop = False
+
+        while not stop:
+            batch = [ q.get() ]
+
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+
+                q.task_done()
+
+            self._flush()
+
+    def handle(self, record):
+        handlers = self._routes.get(getattr(record, "log_route", None), self.handlers)
+
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.acquire()
+                try:
+                    if handler.filter(record):
+                        handler.emit(record)
+                finally:
+                    handler.release()
+
+    def _flush(self):
+        for handler in self.handlers:
+            try:
+                handler.flush()
+            except Exception:
+                pass
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LogQueue(object):
+    """
+    Moves every handler configured on the root logger and on the named
+    loggers behind a single bounded queue served by one listener thread.
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE, cache_size=DEFAULT_CACHE_SIZE):
+        self._queue = DropOldestQueue(maxsize)
+        self._batch_size = batch_size
+        self._cache_size = cache_size
+        self._listener = None
+        self._handlers = list()
+        self._loggers = dict()
+        self._routes = dict()
+
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def dropped(self):
+        return self._queue.dropped
+
+    @property
+    def running(self):
+        return self._listener is not None
+
+    def _configured_loggers(self):
+        loggers = [ logging.getLogger() ]
+
+        for logger in logging.Logger.manager.loggerDict.values():
+            if isinstance(logger, logging.Logger) and logger.handlers:
+                loggers.append(logger)
+
+        return loggers
+
+    def start(self):
+        if self._listener is not None:
+            return self
+
+        for logger in self._configured_loggers():
+            if not logger.handlers:
+                continue
+
+            self._loggers[logger] = list(logger.handlers)
+
+            for handler in logger.handlers:
+                if handler not in self._handlers:
+                    self._handlers.append(handler)
+
+        # one queue handler per logger, each forwarding only to the handlers
+        # that logger had before: the listener routes records by logger name
+        self._routes = {
+            logger.name: tuple(handlers) for logger, handlers in self._loggers.items() }
+
+        for logger in self._loggers:
+            queue_handler = CachingQueueHandler(self._queue, self._cache_size)
+            queue_handler.addFilter(_RouteFilter(logger.name))
+
+            logger.handlers = [ queue_handler ]
+
+        self._listener = BatchQueueListener(
+            self._queue, *self._handlers, routes=self._routes, batch_size=self._batch_size)
+        self._listener.start()
+
+        atexit.register(self.stop)
+
+        return self
+
+    def stop(self):
+        if self._listener is None:
+            return
+
+        listener = self._listener
+        self._listener = None
+
+        # give the handlers back first, then let the listener drain whatever
+        # is still queued before its thread ends
+        for logger, handlers in self._loggers.items():
+            logger.handlers = handlers
+
+        listener.stop()
+
+        self._loggers = dict()
+        self._routes = dict()
+        self._handlers = list()
+
+        if self.dropped > 0:
+            logging.getLogger().warning(
+                "Log queue dropped {0} record(s) because it was full".format(self.dropped))
+
+        try:
+            atexit.unregister(self.stop)
+        except Exception:
+            pass
+
+
+class _RouteFilter(logging.Filter):
+
+    def __init__(self, route):
+        super(_RouteFilter, self).__init__()
+        self._route = route
+
+    def filter(self, record):
+        record.log_route = self._route
+
+        return True
@@ -10,42 +10,648 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 
-from .common import evaluate_string
+from .common import Wrap, compile_template
 from .security import security_decode
 
 import atexit
+import collections
+import concurrent.futures as cf
+import heapq
+import itertools
+import json
 import logging
 import os
 import smtplib
+import tempfile
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_LIFETIME = 300.0
+DEFAULT_MAX_MESSAGES = 100
+DEFAULT_IDLE_CHECK = 30.0
+DEFAULT_TIMEOUT = 60.0
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 2.0
+DEFAULT_MAX_BACKOFF = 600.0
+DEFAULT_FLUSH_TIMEOUT = 10.0
 
 class Template(object):
     
     def __init__(self, path):
         with open(path, "rt") as f:
             self._template = f.read()
+        
+        self._compiled = compile_template(self._template)
     
     def render(self, **kwargs):
-        return evaluate_string(self._template, kwargs, False)
+        return self._compiled.render(kwargs)
+
+def _value(value, default):
+    return default if value is None else value
+
+class _PooledConnection(object):
+    __slots__ = ("smtp", "created", "last_used", "messages")
+    
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.messages = 0
+
+class _Session(object):
+    """
+    What SMTPPool.connection() hands out: the checked out smtplib connection,
+    counting every message sent through it against the pool limit.
+    """
+    __slots__ = ("_conn", "_max_messages")
+    
+    def __init__(self, conn, max_messages):
+        self._conn = conn
+        self._max_messages = max_messages
+    
+    @property
+    def exhausted(self):
+        return self._conn.messages >= self._max_messages
+    
+    def sendmail(self, *args, **kwargs):
+        # a refused message went through the session all the same
+        self._conn.messages += 1
+        
+        return self._conn.smtp.sendmail(*args, **kwargs)
+    
+    def send_message(self, *args, **kwargs):
+        self._conn.messages += 1
+        
+        return self._conn.smtp.send_message(*args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self._conn.smtp, name)
+
+class SMTPPool(object):
+    """
+    Bounded pool of authenticated SMTP connections. A connection is checked
+    out for each send, probed with NOOP when it has been idle for a while
+    and replaced once it reaches its maximum lifetime or message count.
+    """
+    
+    def __init__(self, server, port, tls=False, username=None, password=None, size=DEFAULT_POOL_SIZE,
+                 max_lifetime=DEFAULT_MAX_LIFETIME, max_messages=DEFAULT_MAX_MESSAGES,
+                 idle_check=DEFAULT_IDLE_CHECK, timeout=DEFAULT_TIMEOUT):
+        self._server = server
+        self._port = port
+        self._tls = tls
+        self._username = username
+        self._password = password
+        self._size = size
+        self._max_lifetime = max_lifetime
+        self._max_messages = max_messages
+        self._idle_check = idle_check
+        self._timeout = timeout
+        
+        self._idle = collections.deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._opened = 0
+    
+    @staticmethod
+    def from_config(smtp):
+        return SMTPPool(
+            smtp.server, smtp.port, bool(smtp.tls),
+            None if smtp.username is None else security_decode(str(smtp.username)),
+            None if smtp.password is None else security_decode(str(smtp.password)),
+            size=_value(smtp.pool_size, DEFAULT_POOL_SIZE),
+            max_lifetime=_value(smtp.max_lifetime, DEFAULT_MAX_LIFETIME),
+            max_messages=_value(smtp.max_messages, DEFAULT_MAX_MESSAGES),
+            idle_check=_value(smtp.idle_check, DEFAULT_IDLE_CHECK),
+            timeout=_value(smtp.timeout, DEFAULT_TIMEOUT))
+    
+    @property
+    def size(self):
+        return self._size
+    
+    @property
+    def opened(self):
+        """
+        Number of connections opened so far.
+        """
+        return self._opened
+    
+    def _connect(self):
+        smtp = smtplib.SMTP(self._server, self._port, timeout=self._timeout)
+        
+        try:
+            smtp.ehlo()
+            
+            if (self._tls):
+                smtp.starttls()
+                smtp.ehlo()
+            
+            if (self._username is not None):
+                smtp.login(self._username, self._password)
+        except:
+            smtp.close()
+            raise
+        
+        with self._lock:
+            self._opened += 1
+        
+        return _PooledConnection(smtp)
+    
+    def _expired(self, conn, now):
+        return (now - conn.created >= self._max_lifetime or conn.messages >= self._max_messages)
+    
+    def _healthy(self, conn):
+        now = time.monotonic()
+        
+        if (self._expired(conn, now)):
+            return False
+        
+        if (now - conn.last_used >= self._idle_check):
+            try:
+                return conn.smtp.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                return False
+        
+        return True
+    
+    def _discard(self, conn):
+        try:
+            conn.smtp.quit()
+        except:
+            conn.smtp.close()
+    
+    def _checkout(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            
+            if (conn is None):
+                return self._connect()
+            elif (self._healthy(conn)):
+                return conn
+            else:
+                self._discard(conn)
+    
+    def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        
+        with self._lock:
+            if (not self._closed and not self._expired(conn, conn.last_used)):
+                self._idle.append(conn)
+                conn = None
+        
+        if (conn is not None):
+            self._discard(conn)
+    
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection (opening one if no idle connection is
+        usable) for the duration of the block; at most 'size' connections
+        are in use at the same time. Each message sent through it counts
+        toward 'max_messages'; 'exhausted' tells when the limit is reached.
+        """
+        if (self._closed):
+            raise RuntimeError("SMTP pool is closed")
+        
+        self._slots.acquire()
+        conn = None
+        
+        try:
+            conn = self._checkout()
+            
+            yield _Session(conn, self._max_messages)
+        except smtplib.SMTPServerDisconnected:
+            if (conn is not None):
+                conn.smtp.close()
+                conn = None
+            
+            raise
+        except smtplib.SMTPException:
+            # refused recipients, data errors...: smtplib has reset the
+            # session and the connection stays usable, unless the server
+            # closed it (421)
+            if (conn is not None and conn.smtp.sock is None):
+                conn = None
+            
+            raise
+        except OSError:
+            # socket level failure (SMTPException is an OSError too)
+            if (conn is not None):
+                conn.smtp.close()
+                conn = None
+            
+            raise
+        finally:
+            if (conn is not None):
+                self._checkin(conn)
+            
+            self._slots.release()
+    
+    def sendmail(self, from_addr, recipients, msg):
+        """
+        Send over a pooled connection; a connection dropped by the server
+        is replaced and the send retried once.
+        """
+        try:
+            with self.connection() as smtp:
+                return smtp.sendmail(from_addr, recipients, msg)
+        except smtplib.SMTPServerDisconnected:
+            with self.connection() as smtp:
+                return smtp.sendmail(from_addr, recipients, msg)
+    
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        
+        for conn in idle:
+            self._discard(conn)
+
+class MailQueue(object):
+    """
+    Messages waiting for delivery, drained by a background sender thread in
+    batches sent over one pooled connection each. Failed sends are retried
+    with exponential backoff; with a spool directory every message is also
+    kept on disk until delivered, and reloaded at the next start. Spool
+    files are claimed by renaming them to a name carrying the queue owner,
+    so queues of different processes on one host can share a directory;
+    the claims of dead processes are taken over.
+    """
+    
+    def __init__(self, pool, spool=None, batch_size=DEFAULT_BATCH_SIZE, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF, logger=None):
+        self._pool = pool
+        self._spool = spool
+        self._batch_size = batch_size
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self._cond = threading.Condition()
+        self._ready = collections.deque()
+        self._delayed = list()
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._stopping = False
+        self._owner = "{0}-{1}".format(os.getpid(), uuid.uuid4().hex[:8])
+        
+        self._started = time.time()
+        self._counters = collections.OrderedDict(
+            (k, 0) for k in ("enqueued", "sent", "retried", "failed", "batches"))
+        self._send_time = 0.0
+        
+        if (self._spool is not None):
+            os.makedirs(os.path.join(self._spool, "failed"), exist_ok=True)
+            self._load_spool()
+        
+        self._thread = threading.Thread(target=self._run, name="MailQueue", daemon=True)
+        self._thread.start()
+    
+    @staticmethod
+    def from_config(pool, queue, logger=None):
+        return MailQueue(
+            pool, queue.spool,
+            batch_size=_value(queue.batch_size, DEFAULT_BATCH_SIZE),
+            retries=_value(queue.retries, DEFAULT_RETRIES),
+            backoff=_value(queue.backoff, DEFAULT_BACKOFF),
+            max_backoff=_value(queue.max_backoff, DEFAULT_MAX_BACKOFF),
+            logger=logger)
+    
+    @property
+    def pending(self):
+        return self._pending
+    
+    @property
+    def metrics(self):
+        with self._cond:
+            result = collections.OrderedDict(self._counters)
+            result["pending"] = self._pending
+        
+        result["send_seconds"] = self._send_time
+        result["messages_per_s"] = result["sent"] / self._send_time if self._send_time > 0 else None
+        result["uptime_s"] = time.time() - self._started
+        
+        return result
+    
+    def _count(self, name, n=1):
+        self._counters[name] += n
+    
+    def _write(self, item):
+        if (self._spool is None):
+            return
+        
+        fd, tmp = tempfile.mkstemp(prefix=".mail-", dir=self._spool)
+        
+        try:
+            with os.fdopen(fd, "wt") as f:
+                json.dump({ k: v for k, v in item.items() if k != "path" }, f)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            os.replace(tmp, item["path"])
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            
+            raise
+    
+    def _claimed(self, name):
+        return os.path.join(self._spool, "{0}.{1}.inflight".format(name, self._owner))
+    
+    @staticmethod
+    def _orphaned(name):
+        # '<mail>.json.<pid>-<queue>.inflight', claimed by a process now gone
+        try:
+            pid = int(name.rsplit(".", 2)[1].split("-")[0])
+            os.kill(pid, 0)
+        except (IndexError, ValueError, ProcessLookupError):
+            return True
+        except PermissionError:
+            return False
+        
+        return False
+    
+    def _claim(self, name):
+        # the rename is atomic: of all the queues sharing the spool, only
+        # one gets the file
+        path = self._claimed(name.split(".json", 1)[0] + ".json")
+        
+        try:
+            os.rename(os.path.join(self._spool, name), path)
+        except FileNotFoundError:
+            return None
+        
+        return path
+    
+    @staticmethod
+    def _unclaimed(path):
+        return path.split(".json", 1)[0] + ".json"
+    
+    def _load_spool(self):
+        for name in sorted(os.listdir(self._spool)):
+            if (name.endswith(".json") or (name.endswith(".inflight") and self._orphaned(name))):
+                path = self._claim(name)
+            else:
+                continue
+            
+            if (path is None):
+                continue
+            
+            try:
+                with open(path, "rt") as f:
+                    item = json.load(f)
+            except Exception as ex:
+                self.logger.error(f"Skipping unreadable spooled mail '{path}': {ex}")
+                continue
+            
+            item["path"] = path
+            
+            heapq.heappush(self._delayed, (item.get("next_try", 0), next(self._sequence), item))
+            self._pending += 1
+        
+        if (self._pending):
+            self.logger.info(f"Reloaded {self._pending} spooled mail(s)")
+    
+    def put(self, from_addr, recipients, msg):
+        if (self._stopping):
+            raise RuntimeError("Mail queue is stopped")
+        
+        item = {
+            "from" : from_addr,
+            "to" : list(recipients),
+            "msg" : msg,
+            "attempts" : 0,
+            "created" : time.time(),
+            "next_try" : 0
+        }
+        
+        if (self._spool is not None):
+            item["path"] = self._claimed("{0:020d}-{1}.json".format(int(item["created"] * 1e6), uuid.uuid4().hex))
+            self._write(item)
+        
+        with self._cond:
+            if (self._stopping):
+                # stopped while the message was being written
+                self._remove(item)
+                
+                raise RuntimeError("Mail queue is stopped")
+            
+            self._ready.append(item)
+            self._pending += 1
+            self._count("enqueued")
+            
+            self._cond.notify_all()
+    
+    def _next_batch(self):
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[2])
+                
+                if (self._ready):
+                    return [ self._ready.popleft() for _ in range(min(self._batch_size, len(self._ready))) ]
+                
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+            
+            return None
+    
+    def _remove(self, item):
+        if (item.get("path") is None):
+            return
+        
+        try:
+            os.unlink(item["path"])
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            self.logger.error(f"Cannot remove spooled mail '{item['path']}': {ex}")
+    
+    def _done(self, item):
+        try:
+            self._remove(item)
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._count("sent")
+                self._cond.notify_all()
+    
+    def _fail(self, item, error):
+        self.logger.error(f"Cannot deliver mail to {item['to']} after {item['attempts']} attempt(s): {error}")
+        
+        try:
+            if (item.get("path") is not None):
+                os.replace(item["path"], os.path.join(
+                    self._spool, "failed", os.path.basename(self._unclaimed(item["path"]))))
+        except OSError as ex:
+            self.logger.error(f"Cannot move spooled mail '{item['path']}' to failed: {ex}")
+        finally:
+            with self._cond:
+                self._pending -= 1
+                self._count("failed")
+                self._cond.notify_all()
+    
+    def _retry(self, item, error):
+        item["attempts"] += 1
+        
+        if (item["attempts"] > self._retries):
+            self._fail(item, error)
+            return
+        
+        delay = min(self._max_backoff, self._backoff * 2 ** (item["attempts"] - 1))
+        item["next_try"] = time.time() + delay
+        
+        self.logger.warning(f"Mail to {item['to']} not sent ({error}), retrying in {delay:.1f}s")
+        
+        try:
+            self._write(item)
+        except OSError as ex:
+            self.logger.error(f"Cannot update spooled mail '{item['path']}': {ex}")
+        
+        with self._cond:
+            heapq.heappush(self._delayed, (item["next_try"], next(self._sequence), item))
+            self._count("retried")
+            self._cond.notify_all()
+    
+    @staticmethod
+    def _permanent(ex):
+        if (isinstance(ex, smtplib.SMTPRecipientsRefused)):
+            return all(code >= 500 for code, _ in ex.recipients.values())
+        else:
+            return isinstance(ex, smtplib.SMTPResponseException) and ex.smtp_code >= 500
+    
+    def _send_batch(self, batch):
+        sent = 0
+        start = time.perf_counter()
+        
+        try:
+            while (sent < len(batch)):
+                # a connection that reaches its message limit is checked in
+                # (and replaced) before the rest of the batch goes out
+                with self._pool.connection() as smtp:
+                    first = sent
+                    
+                    for item in batch[first:]:
+                        if (sent > first and smtp.exhausted):
+                            break
+                        
+                        try:
+                            smtp.sendmail(item["from"], item["to"], item["msg"])
+                        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as ex:
+                            # refused by the server: the connection is still usable
+                            sent += 1
+                            
+                            if (self._permanent(ex)):
+                                item["attempts"] += 1
+                                self._fail(item, ex)
+                            else:
+                                self._retry(item, ex)
+                            
+                            continue
+                        
+                        sent += 1
+                        self._done(item)
+        except Exception as ex:
+            for item in batch[sent:]:
+                self._retry(item, ex)
+        finally:
+            self._send_time += time.perf_counter() - start
+            
+            with self._cond:
+                self._count("batches")
+    
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            
+            if (batch is None):
+                return
+            
+            try:
+                self._send_batch(batch)
+            except Exception:
+                self.logger.exception("Unexpected error in mail sender")
+    
+    def flush(self, timeout=None):
+        """
+        Wait until every queued message has been delivered or has failed.
+        Messages waiting for a retry are tried again right away, later
+        retries keep their backoff. Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        
+        with self._cond:
+            while self._delayed:
+                self._ready.append(heapq.heappop(self._delayed)[2])
+            
+            self._cond.notify_all()
+            
+            while self._pending > 0 and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                
+                if (remaining is not None and remaining <= 0):
+                    return False
+                
+                self._cond.wait(remaining)
+            
+            return self._pending == 0
+    
+    def stop(self, timeout=DEFAULT_FLUSH_TIMEOUT):
+        """
+        Flush for at most 'timeout' seconds, then stop the sender; messages
+        still pending stay in the spool, released for the next queue.
+        """
+        self.flush(timeout)
+        
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        
+        self._thread.join()
+        
+        if (self._spool is not None):
+            for item in itertools.chain(self._ready, (entry[2] for entry in self._delayed)):
+                try:
+                    os.rename(item["path"], self._unclaimed(item["path"]))
+                except OSError as ex:
+                    self.logger.error(f"Cannot release spooled mail '{item['path']}': {ex}")
+            
+            self._ready.clear()
+            self._delayed = list()
+        
+        if (self._pending):
+            self.logger.warning(f"Mail queue stopped with {self._pending} undelivered mail(s)")
 
 class MailManager(object):
     
     def __init__(self, use_mail, config, logger=None):
         self._use_mail = use_mail
-        self._smtp = None
+        self._pool = None
+        self._queue = None
         self.logger = logger or logging.getLogger(config.logger)
         
         try:
             if (self._use_mail):
-                self._smtp = smtplib.SMTP(config.smtp.server, config.smtp.port)
-                
-                self._smtp.ehlo()
+                self._pool = SMTPPool.from_config(config.smtp)
                 
-                if (config.smtp.tls):
-                    self._smtp.starttls()
+                # open the first connection now, so that bad settings fail early
+                with self._pool.connection():
+                    pass
                 
-                self._smtp.login(
-                    security_decode(str(config.smtp.username)), 
-                    security_decode(str(config.smtp.password)))
+                if (config.mail_queue is not None and config.mail_queue.enabled is not False):
+                    self._queue = MailQueue.from_config(self._pool, config.mail_queue, self.logger)
+                    self._flush_timeout = _value(config.mail_queue.flush_timeout, DEFAULT_FLUSH_TIMEOUT)
                 
                 atexit.register(self._destroy_me)
             else:
@@ -56,15 +662,44 @@ class MailManager(object):
             raise Exception("Cannot connect to SMTP server", ex)
     
     
-    def send_mail(self, mail, template, context=None):
-        from_addr = mail["from"] # "from" is a reserved keyword
-        to_addr = mail.to
-        cc_addr = mail.cc
-        mime_type = "plain" if (not mail.mime) else mail.mime
-        subject = mail.subject
-                
-        body = template.render(**(dict() if context is None else context))
-
+    @staticmethod
+    def _attachments(mail):
+        """
+        Attachments of 'mail' as base64 encoded MIME parts.
+        """
+        parts = list()
+        attachment_list = mail.attach
+        
+        if (not attachment_list):
+            return parts
+        
+        if isinstance(attachment_list, str):
+            attachment_list = [ attachment_list ]
+        
+        for attachment in attachment_list:
+            with open(attachment, "rb") as f:
+                obj = MIMEBase("application", "octet-stream")
+                obj.set_payload(f.read())
+            
+            obj.add_header("Content-Disposition", "attachment", filename="{0}".format(os.path.basename(attachment)))
+            encoders.encode_base64(obj)
+            
+            parts.append(obj)
+        
+        return parts
+    
+    
+    @staticmethod
+    def _headers(mail):
+        """
+        'from', 'to', 'cc' and 'subject' of 'mail', resolved like any other
+        key ("[to]", "[subject]"... are evaluated with its context).
+        """
+        return getattr(mail, "from"), mail.to, mail.cc, mail.subject # "from" is a reserved keyword
+    
+    
+    @staticmethod
+    def _message(from_addr, to_addr, cc_addr, subject, body, mime_type, parts):
         msg = MIMEMultipart()
         msg['From'] = from_addr
         msg['To'] = to_addr
@@ -78,32 +713,108 @@ class MailManager(object):
             for s in cc_addr.split(","):
                 recipients.append(s.strip())
         
-        if (mail.attach and self._use_mail):
-            attachment_list = mail.attach
-
-            if isinstance(attachment_list, str):
-                attachment_list = [ attachment_list ]
-            
-            for attachment in attachment_list:
-                with open(attachment, "rb") as f:
-                    obj = MIMEBase("application", "octet-stream")
-                    obj.set_payload(f.read())
-                
-                obj.add_header("Content-Disposition", "attachment", filename="{0}".format(os.path.basename(attachment)))
-                encoders.encode_base64(obj)
+        for part in parts:
+            msg.attach(part)
+        
+        return recipients, msg
+    
+    
+    def send_mail(self, mail, template, context=None):
+        from_addr, to_addr, cc_addr, subject = self._headers(mail)
+        mime_type = "plain" if (not mail.mime) else mail.mime
                 
-                msg.attach(obj)
+        body = template.render(**(dict() if context is None else context))
+        
+        recipients, msg = self._message(
+            from_addr, to_addr, cc_addr, subject, body, mime_type,
+            self._attachments(mail) if self._use_mail else list())
         
         if (self._use_mail):
-            self._smtp.sendmail(from_addr, recipients, msg.as_string())
+            if (self._queue is not None):
+                self._queue.put(from_addr, recipients, msg.as_string())
+            else:
+                self._pool.sendmail(from_addr, recipients, msg.as_string())
         else:
             self.logger.warning("Cannot send mail ('use_mail' is False)")
     
     
+    def send_many(self, mail, template, contexts, workers=None):
+        """
+        Send 'template' once per context. The 'from', 'to', 'cc' and
+        'subject' of 'mail' are resolved as in send_mail, with each context
+        laid over the context of 'mail' (so "[to]": "${email}" gives every
+        message its own recipient); attachments are read and encoded once.
+        Messages go out in parallel over the pooled connections (or to the
+        queue in queued mode). Returns one status per context, in order:
+        a dict with 'to', 'status' (sent, queued, failed or skipped),
+        'refused' recipients and 'error'.
+        """
+        contexts = list(contexts)
+        mime_type = "plain" if (not mail.mime) else mail.mime
+        parts = self._attachments(mail) if self._use_mail else list()
+        
+        if (not self._use_mail):
+            self.logger.warning("Cannot send mail ('use_mail' is False)")
+        
+        def send_one(context):
+            status = { "to" : None, "status" : "failed", "refused" : dict(), "error" : None }
+            
+            try:
+                context = dict() if context is None else context
+                from_addr, to_addr, cc_addr, subject = self._headers(
+                    Wrap(mail.to_object(), collections.ChainMap(context, mail.get_context()), mail.evaluate))
+                
+                recipients, msg = self._message(
+                    from_addr, to_addr, cc_addr, subject, template.render(**context), mime_type, parts)
+                status["to"] = recipients
+                
+                if (not self._use_mail):
+                    status["status"] = "skipped"
+                elif (self._queue is not None):
+                    self._queue.put(from_addr, recipients, msg.as_string())
+                    status["status"] = "queued"
+                else:
+                    refused = self._pool.sendmail(from_addr, recipients, msg.as_string())
+                    
+                    status["refused"] = { k: list(v) for k, v in refused.items() }
+                    status["status"] = "sent"
+            except Exception as ex:
+                status["error"] = str(ex)
+                
+                self.logger.error(f"Cannot send mail to {status['to']}: {ex}")
+            
+            return status
+        
+        if (not self._use_mail or self._queue is not None or len(contexts) <= 1):
+            return [ send_one(context) for context in contexts ]
+        
+        with cf.ThreadPoolExecutor(max_workers=workers or self._pool.size) as executor:
+            return list(executor.map(send_one, contexts))
+    
+    
+    def flush(self, timeout=None):
+        """
+        Wait for the queued mails to be delivered; always True when mails
+        are sent synchronously.
+        """
+        return True if self._queue is None else self._queue.flush(timeout)
+    
+    
+    @property
+    def metrics(self):
+        return None if self._queue is None else self._queue.metrics
+    
+    
     def _destroy_me(self):
         try:
-            if (self._smtp):
-                self._smtp.quit()
+            if (self._queue):
+                self._queue.stop(self._flush_timeout)
+        except:
+            pass
+        
+        try:
+            if (self._pool):
+                self._pool.close()
         except:
             # silently ignore exception
             pass
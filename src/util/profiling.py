@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:20:05 2026
+
+@author: pasquale
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PROFILE_CPU = "cpu"
+PROFILE_MEM = "mem"
+
+_IMPORT_TIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def import_profile(module_names):
+    """
+    Import the given modules in a fresh interpreter run with '-X importtime'
+    and return one entry per imported module, in import order.
+    """
+    statement = "; ".join(f"import {name}" for name in module_names)
+
+    proc = subprocess.run(
+        [ sys.executable, "-X", "importtime", "-c", statement ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+
+    if proc.returncode != 0:
+        raise RuntimeError(
+            "Cannot profile import of {0}: {1}".format(module_names, proc.stderr.strip().splitlines()[-1:]))
+
+    entries = list()
+
+    for line in proc.stderr.splitlines():
+        match = _IMPORT_TIME_RE.match(line)
+
+        if match:
+            entries.append({
+                "module" : match.group(4),
+                "self_us" : int(match.group(1)),
+                "cumulative_us" : int(match.group(2)),
+                "depth" : len(match.group(3)) // 2
+            })
+
+    return entries
+
+
+def format_import_profile(entries, top=20):
+    total = sum(entry["cumulative_us"] for entry in entries if entry["depth"] == 0)
+
+    lines = [ "Import profile: {0:.1f} ms total, {1} modules".format(total / 1000.0, len(entries)) ]
+    lines.append("{0:>10} {1:>10}  {2}".format("self[ms]", "cumul[ms]", "module"))
+
+    for entry in sorted(entries, key=lambda e: e["cumulative_us"], reverse=True)[:top]:
+        lines.append("{0:>10.1f} {1:>10.1f}  {2}".format(
+            entry["self_us"] / 1000.0, entry["cumulative_us"] / 1000.0, entry["module"]))
+
+    return lines, total
+
+
+class PhaseTimer(object):
+    """
+    Wall-clock duration of the named phases of a run, in the order they
+    were first entered; re-entering a phase accumulates its duration.
+    """
+
+    def __init__(self):
+        self._phases = OrderedDict()
+        self._created = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self._phases[name] = self._phases.get(name, 0.0) + seconds
+
+    def get(self, name):
+        return self._phases.get(name)
+
+    @property
+    def phases(self):
+        return OrderedDict(self._phases)
+
+    def log(self, logger):
+        for name, seconds in self._phases.items():
+            logger.info("Phase '{0}' took {1:.3f} ms".format(name, seconds * 1000.0))
+
+    def to_dict(self, **extra):
+        result = {
+            "timestamp" : self._created,
+            "phases_ms" : OrderedDict((k, v * 1000.0) for k, v in self._phases.items())
+        }
+
+        result.update(extra)
+
+        return result
+
+    def write(self, path, **extra):
+        with open(path, "wt") as f:
+            json.dump(self.to_dict(**extra), f, indent=2)
+            f.write("\n")
+
+
+def run_profiled(func, kind, top=25):
+    """
+    Call 'func' under cProfile ('cpu') or tracemalloc ('mem') and return
+    the pair (result, report), where report lists the top-N entries.
+    """
+    if kind == PROFILE_CPU:
+        profiler = cProfile.Profile()
+
+        try:
+            result = profiler.runcall(func)
+        finally:
+            stream = io.StringIO()
+
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+        return result, stream.getvalue()
+    elif kind == PROFILE_MEM:
+        tracemalloc.start(25)
+
+        try:
+            result = func()
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+
+            tracemalloc.stop()
+
+        lines = [ "Memory profile: current={0:.1f} KiB, peak={1:.1f} KiB".format(current / 1024.0, peak / 1024.0) ]
+
+        for stat in snapshot.statistics("lineno")[:top]:
+            lines.append(str(stat))
+
+        return result, "\n".join(lines) + "\n"
+    else:
+        raise RuntimeError("Unexpected profile kind: {0}".format(kind))
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul 11 18:53:22 2018
+
+@author: CAPUANO-P
+"""
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
+from telegram.ext import Updater, CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler, Filters
+from util.security import security_decode
+from util.task import TASK_RUN_CONFLICT, TASK_RUN_SINGLETON
+
+class TaskTelegramController(object):
+    
+    s_ASK_TASK, s_ASK_ARGS, s_ASK_CONFIRM, s_RESULT = range(4)
+    UD_RUN = "run"
+    CB_RUN = "__run__"
+    CB_YES = "__yes__"
+    CB_NO = "__no__"
+    CB_BACK = "__back__"
+    CB_CANCEL = "__cancel__"
+    
+    def __init__(self, config, manager, logger):
+        self._users = config.users.to_object()
+        self._manager = manager
+        self._logger = logger
+        self._running = False
+        
+        token = security_decode(config.token)
+        
+        self._updater = Updater(token, use_context=True)
+        self._dispatcher = self._updater.dispatcher
+        
+        run_handler = ConversationHandler(
+            entry_points = [ CommandHandler("run", self.do_run_start) ],
+            states = {
+                TaskTelegramController.s_ASK_TASK: [
+                    CallbackQueryHandler(self.do_run_ask_task)
+                ],
+                
+                TaskTelegramController.s_ASK_ARGS: [
+                    CallbackQueryHandler(self.do_run_ask_args),
+                    MessageHandler(Filters.text, self.do_run_ask_args),
+                ],
+                
+                TaskTelegramController.s_ASK_CONFIRM: [
+                    CallbackQueryHandler(self.do_run_ask_confirm)
+                ]
+            },
+                    
+            fallbacks = [ CommandHandler("cancel", self.do_run_cancel) ]
+        )
+    
+        self._dispatcher.add_handler(run_handler)
+        self._dispatcher.add_handler(CommandHandler("tasklist", self.do_tasklist))
+        
+        self._logger.info("TaskTelegramController initialized")
+    
+    @property
+    def running(self):
+        return self._running
+    
+    def do_run_init_task(self, task, update, context):
+        context.user_data[TaskTelegramController.UD_RUN]["task"] = task
+        
+        if task.args is None:
+            next = TaskTelegramController.s_ASK_CONFIRM
+            
+            context.user_data[TaskTelegramController.UD_RUN]["args"] = dict()
+            
+            self._prepare_do_run_ask_confirm(update, context)
+        else:
+            next = TaskTelegramController.s_ASK_ARGS
+            
+            args = dict()
+            context.user_data[TaskTelegramController.UD_RUN]["args"] = args
+            
+            for k,v in task.default_args.items():
+                args[k] = v
+            
+            self._prepare_do_run_ask_args(update, context)
+        
+        return next
+    
+    def do_run_start(self, update, context):
+        user = update.message.from_user.username
+        
+        if user not in self._users:
+            self._logger.error(f"User {user} not authorized")
+            
+            return ConversationHandler.END
+        else:
+            self._logger.info(f"Run request received from user {user}")
+        
+        context.user_data[TaskTelegramController.UD_RUN] = dict()
+        
+        if len(context.args) > 0:
+            name = context.args[0]
+        
+            self._logger.debug(f"/run command received task name '{name}'")
+            
+            task = self._manager.get_task(name)
+            
+            if task is not None:
+                next = self.do_run_init_task(task, update, context)
+            else:
+                self._logger.debug(f"Task name '{name}' not found in task list")
+                
+                next = TaskTelegramController.s_ASK_TASK
+                
+                self._prepare_do_run_ask_task(f"Task *{name}* not found\\.", update, context)
+        else:
+            self._logger.debug(f"/run command received no command: need to ask task")
+            
+            next = TaskTelegramController.s_ASK_TASK
+                
+            self._prepare_do_run_ask_task("", update, context)
+        
+        return next
+    
+    def  _prepare_do_run_ask_task(self, prefix, update, context):
+        message = f"{prefix} Choose one of the available tasks".strip()
+        
+        keyboard = InlineKeyboardMarkup(
+                [[InlineKeyboardButton(text=name, callback_data=name) for name in sorted(self._manager.task_list.keys())]])
+        
+        update.message.reply_markdown_v2(text=message, reply_markup=keyboard)
+    
+    def do_run_ask_task(self, update, context):
+        update.callback_query.answer()
+        update.callback_query.message.edit_reply_markup()
+        
+        task = self._manager.get_task(update.callback_query.data)
+        
+        return self.do_run_init_task(task, update, context)
+    
+    def  _prepare_do_run_ask_args(self, update, context):
+        task = context.user_data[TaskTelegramController.UD_RUN]["task"]
+        args = context.user_data[TaskTelegramController.UD_RUN]["args"]
+        
+        keys = list()
+        
+        for arg_name in task.args:
+            if arg_name in args:
+                arg_text = f"{arg_name} ({args[arg_name]})"
+            else:
+                arg_text = f"{arg_name}"
+            
+            key = InlineKeyboardButton(text=arg_text, callback_data=arg_name)
+        
+            keys.append([key])
+        
+        keys.append([InlineKeyboardButton(text="Run task", callback_data=TaskTelegramController.CB_RUN)])
+        
+        keyboard = InlineKeyboardMarkup(keys)
+        
+        message = f"Edit arguments of task *{task.name}*"
+        
+        if update.callback_query is None:
+            update.message.reply_markdown_v2(text=message, reply_markup=keyboard)
+        else:
+            update.callback_query.message.reply_markdown_v2(text=message, reply_markup=keyboard)
+    
+    def do_run_ask_args(self, update, context):
+        task = context.user_data[TaskTelegramController.UD_RUN]["task"]
+        args = context.user_data[TaskTelegramController.UD_RUN]["args"]
+        
+        if update.callback_query is not None:
+            update.callback_query.answer()
+            update.callback_query.message.edit_reply_markup()
+            
+            if update.callback_query.data == TaskTelegramController.CB_RUN:
+                self._prepare_do_run_ask_confirm(update, context)
+            
+                return TaskTelegramController.s_ASK_CONFIRM
+            else:
+                arg = update.callback_query.data
+                value = args.get(arg)
+                
+                if value is None:
+                    message = \
+                        f"Argument *{arg}*: _{task.args[arg].description}_\n" \
+                        f"Insert a value \\(expected type: *{task.args[arg].type}*\\)"
+                else:
+                    message = \
+                        f"Argument *{arg}*: _{task.args[arg].description}_\n" \
+                        f"Insert a value \\(expected type: *{task.args[arg].type}*\\): " \
+                        f"current value is `{value}`"
+                
+                context.user_data[TaskTelegramController.UD_RUN]["arg"] = arg
+                
+                update.callback_query.message.reply_markdown_v2(text=message)
+        else:
+            arg = context.user_data[TaskTelegramController.UD_RUN]["arg"]
+            value = update.message.text
+            args[arg] = value
+            
+            del context.user_data[TaskTelegramController.UD_RUN]["arg"]
+            
+            self._prepare_do_run_ask_args(update, context)
+    
+    def  _prepare_do_run_ask_confirm(self, update, context):
+        task = context.user_data[TaskTelegramController.UD_RUN]["task"]
+        args = context.user_data[TaskTelegramController.UD_RUN]["args"]
+        
+        if len(args) > 0:
+            message = f"Do you confirm to run task *{task.name}* with the following arguments?"
+            
+            for k, v in args.items():
+                message += f"\n_{k}_ \\= `{v}`"
+        else:
+            message = f"Do you confirm to run task *{task.name}* with no arguments?"
+            
+        keyboard = InlineKeyboardMarkup([
+                [InlineKeyboardButton(text="Yes", callback_data=TaskTelegramController.CB_YES), 
+                 InlineKeyboardButton(text="No", callback_data=TaskTelegramController.CB_NO)]])
+        
+        if update.callback_query is None:
+            update.message.reply_markdown_v2(text=message, reply_markup=keyboard)
+        else:
+            update.callback_query.message.reply_markdown_v2(text=message, reply_markup=keyboard)
+        
+        return TaskTelegramController.s_ASK_CONFIRM
+    
+    def do_run_ask_confirm(self, update, context):
+        
+        def observer(run):
+            context.dispatcher.bot.send_message(
+                chat_id=update.callback_query.message.chat.id,
+                text=f"Task `{run.id}` completed: run\\_rc\\=`{run.rc}`, run\\_ex\\=`{run.ex}`",
+                parse_mode=ParseMode.MARKDOWN_V2)
+        
+        update.callback_query.answer()
+        update.callback_query.message.edit_reply_markup()
+            
+        if update.callback_query.data in (TaskTelegramController.CB_YES, TaskTelegramController.CB_RUN):
+            task = context.user_data[TaskTelegramController.UD_RUN]["task"]
+            args = context.user_data[TaskTelegramController.UD_RUN]["args"]
+            
+            run, future = self._manager.run_task(task, (observer,), args)
+                    
+            if isinstance(future, int):
+                if future == TASK_RUN_SINGLETON:
+                    message = f"Task *{task.name}* is singleton and is running just now: _cannot run again_"
+                elif future == TASK_RUN_CONFLICT:
+                    message = f"Task *{task.name}* cannot be run because another _conflicting task is already running_"
+                else:
+                    message = f"Cannot run task *{task.name}* just now"
+            else:
+                message = f"Running task *{task.name}*: `{run.id}`"
+            
+            update.callback_query.message.reply_markdown_v2(text=message)
+            
+            del context.user_data[TaskTelegramController.UD_RUN]
+            
+            return ConversationHandler.END
+        elif update.callback_query.data == TaskTelegramController.CB_NO:
+            keyboard = InlineKeyboardMarkup([
+                [InlineKeyboardButton(text="Run", callback_data=TaskTelegramController.CB_RUN), 
+                 InlineKeyboardButton(text="Back", callback_data=TaskTelegramController.CB_BACK),
+                 InlineKeyboardButton(text="Cancel", callback_data=TaskTelegramController.CB_CANCEL)]])
+            
+            message = "Do you want to *run* the task, go *back* and edit arguments or *cancel*?"
+            
+            update.callback_query.message.reply_markdown_v2(text=message, reply_markup=keyboard)
+        elif update.callback_query.data == TaskTelegramController.CB_CANCEL:
+            return self.do_run_cancel(update, context)
+        elif update.callback_query.data == TaskTelegramController.CB_BACK:
+            self._prepare_do_run_ask_args(update, context)
+            
+            return TaskTelegramController.s_ASK_ARGS
+    
+    def do_run_cancel(self, update, context):
+        
+        del context.user_data[TaskTelegramController.UD_RUN]
+        
+        message = "No command will be run."
+        
+        if update.callback_query is None:
+            update.message.reply_text(text=message)
+        else:
+            update.callback_query.message.reply_text(text=message)
+        
+        return ConversationHandler.END
+    
+    def do_tasklist(self, update, context):
+        "Print list of tasks."
+        
+        tasklist = sorted(self._manager.task_list.keys())
+        
+        if len(tasklist) > 0:
+            message = f"Tasklist: {', '.join(tasklist)}"
+        else:
+            message = "Empty tasklist!"
+        
+        update.message.reply_text(text=message)
+    
+    def start(self):
+        if self._running:
+            self._logger.warning("TaskTelegramController is already running.")
+        else:
+            self._running = True
+            self._manager.has_telegram_controller = True
+            
+            self._updater.start_polling()
+            
+            self._logger.info("TaskTelegramController is running.")
+    
+    def stop(self):
+        if self._running:
+            self._running = False
+            
+            self._updater.stop()
+            
+            self._logger.info("TaskTelegramController stopped.")
+        else:
+            self._logger.info("TaskTelegramController not running.")